@@ -24,6 +24,7 @@ Dependencies:
     - matplotlib: Plotting and visualization
     - tkinter: GUI framework
     - llrflibs: RF cavity simulation library
+    - numba: JIT compilation of the simulation kernels (optional)
 
 Usage:
     python advanced_cavity_gui.py
@@ -42,11 +43,129 @@ import tkinter as tk
 from tkinter import ttk, filedialog, messagebox
 import threading
 import time
-import csv
 import json
 from datetime import datetime
-from llrflibs.rf_sim import cav_ss_mech, sim_scav_step
-from llrflibs.rf_control import ss_discrete
+from cavity_kernels import NUMBA_AVAILABLE, mech_state_space, scan_kernel, scan_lockstep, step_batch
+
+# Maximum number of points handed to a plot line (the canvas is < 2000 px wide)
+PLOT_MAX_POINTS = 2000
+
+def decimate(time_data, values, max_points=PLOT_MAX_POINTS):
+    """Strided decimation of one or more traces (values along the last axis)"""
+    stride = max(1, len(time_data) // max_points)
+    return time_data[::stride], values[..., ::stride]
+
+def decimate_envelope(time_data, values, max_points=PLOT_MAX_POINTS):
+    """Min/max decimation of a trace, preserving its envelope"""
+    stride = max(1, 2 * len(time_data) // max_points)
+    if stride == 1:
+        return time_data, values
+    n = len(time_data) // stride * stride
+    blocks = values[:n].reshape(-1, stride)
+    envelope = np.column_stack((blocks.min(axis=1), blocks.max(axis=1))).ravel()
+    return np.repeat(time_data[:n:stride], 2), envelope
+
+class HistoryBuffer:
+    """Fixed-size circular history storage, one preallocated array per field"""
+    
+    FIELDS = ('time', 'detuning')
+    COMPLEX_FIELDS = ('vc', 'vr')  # Magnitude/phase are derived when exported or plotted
+    CONTROL_PARAMS = ('amp', 'phase', 'fsrc', 'pulsed')
+    
+    def __init__(self, capacity, n_modes):
+        self.capacity = capacity
+        self.n_modes = n_modes
+        self.data = {key: np.zeros(capacity) for key in self.FIELDS}
+        self.data.update({key: np.zeros(capacity, dtype=complex) for key in self.COMPLEX_FIELDS})
+        self.mech_modes = np.zeros((n_modes, capacity))
+        self.control_params = {key: np.full(capacity, np.nan) for key in self.CONTROL_PARAMS}
+        self.write_idx = 0
+        self.count = 0
+    
+    def __len__(self):
+        return self.count
+    
+    def advance(self, n=1):
+        """Move the write index forward after n samples have been written"""
+        self.write_idx = (self.write_idx + n) % self.capacity
+        self.count = min(self.count + n, self.capacity)
+    
+    def ordered(self, buf):
+        """Return the stored samples of buf (along the last axis) oldest first"""
+        if self.count < self.capacity:
+            return buf[..., :self.count]
+        return np.concatenate((buf[..., self.write_idx:], buf[..., :self.write_idx]), axis=-1)
+    
+    def get_ordered(self, key):
+        """Return the stored samples of a field oldest first"""
+        return self.ordered(self.data[key])
+    
+    def clear(self):
+        """Discard all stored samples (the arrays are reused as they are)"""
+        self.write_idx = 0
+        self.count = 0
+    
+    def load(self, columns, mech_modes=None, control_params=None):
+        """Replace the contents with the given columns, keeping the newest samples"""
+        self.clear()
+        n = min(len(columns['time']), self.capacity)
+        for key in self.FIELDS:
+            if key in columns and len(columns[key]):
+                self.data[key][:n] = np.asarray(columns[key], dtype=float)[-n:]
+            else:
+                self.data[key][:n] = 0.0
+        for key in self.COMPLEX_FIELDS:
+            self.data[key][:n] = self.complex_column(columns, key)[-n:] if n else 0.0
+        self.mech_modes[:, :n] = 0.0
+        for i, mode_data in enumerate(mech_modes if mech_modes is not None else []):
+            if i < self.n_modes and len(mode_data):
+                self.mech_modes[i, :n] = np.asarray(mode_data, dtype=float)[-n:]
+        for buf in self.control_params.values():
+            buf[:n] = np.nan
+        for key, param_data in (control_params or {}).items():
+            if key in self.control_params and len(param_data):
+                values = np.asarray(param_data, dtype=float)[-n:]
+                self.control_params[key][n - len(values):n] = values
+        self.advance(n)
+    
+    @staticmethod
+    def complex_column(columns, key):
+        """Rebuild a complex column from real/imag or magnitude/phase (deg) columns"""
+        def column(name):
+            values = columns.get(f'{key}_{name}')
+            return np.asarray(values, dtype=float) if values is not None and len(values) else None
+        
+        real, imag = column('real'), column('imag')
+        if real is not None and imag is not None:
+            return real + 1j * imag
+        mag, phase = column('mag'), column('phase')
+        if mag is not None:
+            return mag * np.exp(1j * np.deg2rad(phase)) if phase is not None else mag.astype(complex)
+        return np.zeros(len(columns['time']), dtype=complex)
+    
+    def export_columns(self):
+        """Return the stored samples as real-valued columns, oldest first"""
+        columns = {'time': self.get_ordered('time')}
+        for key in self.COMPLEX_FIELDS:
+            values = self.get_ordered(key)
+            columns[f'{key}_real'] = values.real
+            columns[f'{key}_imag'] = values.imag
+            columns[f'{key}_mag'] = np.abs(values)
+            columns[f'{key}_phase'] = np.angle(values, deg=True)
+        columns['detuning'] = self.get_ordered('detuning')
+        return columns
+    
+    def to_dict(self):
+        """Export the stored samples as plain lists, oldest first"""
+        data = {key: values.tolist() for key, values in self.export_columns().items()}
+        data['mech_modes'] = self.ordered(self.mech_modes).tolist()
+        data['control_params'] = {}
+        for key, buf in self.control_params.items():
+            # Only the samples taken while recording (NaN otherwise), as strict JSON has no NaN
+            values = self.ordered(buf)
+            values = values[~np.isnan(values)]
+            data['control_params'][key] = (values.astype(bool) if key == 'pulsed' else values).tolist()
+        return data
 
 class CavitySimulationGUI:
     def __init__(self, root):
@@ -59,20 +178,14 @@ class CavitySimulationGUI:
         
         # Data storage
         self.max_history = 10000
-        self.history_data = {
-            'time': [],
-            'vc_real': [], 'vc_imag': [], 'vc_mag': [], 'vc_phase': [],
-            'vr_real': [], 'vr_imag': [], 'vr_mag': [], 'vr_phase': [],
-            'detuning': [],
-            'mech_modes': [[] for _ in range(len(self.mech_modes['f']))],
-            'control_params': {'amp': [], 'phase': [], 'fsrc': [], 'pulsed': []}
-        }
+        self.history = HistoryBuffer(self.max_history, len(self.mech_modes['f']))
         
         # Control variables
         self.simulation_running = False
         self.recording = False
         self.playback_mode = False
         self.playback_index = 0
+        self.playback_traces = None  # Plot traces of the whole history while in playback
         
         # GUI setup
         self.setup_gui()
@@ -89,6 +202,12 @@ class CavitySimulationGUI:
         self.t_flat = 1300
         self.buf_size = 2048 * 8
         self.pul_len = 2048 * 10
+        self.batch_size = 100  # Steps per compiled batch (one GUI update)
+        # Wall-clock slowdown of the simulation (1 = real time). At real time a batch
+        # would last 100 us and the whole history only 10 ms, too fast to follow on screen.
+        self.realtime_factor = 100
+        self.seed = None  # Set to an integer for a reproducible microphonics stream
+        self.micr_scale = 2.0 * np.pi * 10  # Microphonics detuning std (rad/s)
         
         # Cavity parameters
         self.mech_modes = {'f': [280, 341, 460, 487, 618],
@@ -102,27 +221,34 @@ class CavitySimulationGUI:
         self.wh = np.pi * self.f0 / self.QL
         self.ib = 0.008
         
-        # State space initialization
-        status, Am, Bm, Cm, Dm = cav_ss_mech(self.mech_modes)
-        status, self.Ad, self.Bd, self.Cd, self.Dd, _ = ss_discrete(
-            Am, Bm, Cm, Dm, Ts=self.Ts, method='zoh', plot=False, plot_pno=10000)
+        # State space initialization, discretized once for the fixed Ts
+        # (contiguous float64 ndarrays, not np.matrix, for the compiled step kernel)
+        self.Ad, self.Bd, self.Cd, self.Dd = mech_state_space(self.mech_modes, self.Ts)
         
         # Initial states
-        self.state_m = np.matrix(np.zeros(self.Bd.shape))
+        self.state_m = np.zeros(self.Bd.shape[0], dtype=np.float64)
         self.state_vc = 0.0
-        self.pha_src = 0.0
+        self.phasor = 1.0 + 0.0j  # RF source phasor exp(1j*pha_src)
         self.buf_id = 0
         self.dw = 0
+        self.rng = np.random.default_rng(self.seed)
         
         # Beam and baseband setup
         self.beam_pul = np.zeros(self.buf_size, dtype=complex)
         self.beam_cw = 0
         self.beam_pul[self.t_fill:self.t_flat] = self.ib
+        self.ib_dirty = False  # Set when the beam current changes, cleared once applied
         
         self.base_pul = np.zeros(self.buf_size, dtype=complex)
         self.base_cw = 1
         self.base_pul[:self.t_flat] = 1.0
         
+        # Batch output buffers
+        self.batch_vc = np.zeros(self.batch_size, dtype=complex)
+        self.batch_vr = np.zeros(self.batch_size, dtype=complex)
+        self.batch_dw = np.zeros(self.batch_size)
+        self.batch_mech = np.zeros((self.batch_size, len(self.mech_modes['f'])))
+        
         # Control parameters (will be controlled by GUI)
         self.control_params = {
             'amp': 1.0,
@@ -132,6 +258,21 @@ class CavitySimulationGUI:
             'ib': 0.008,
             'gain_dB': 20 * np.log10(12e6)
         }
+        self.apply_control_params()
+    
+    def apply_control_params(self):
+        """Copy the control parameters into the plain attributes read by the simulation"""
+        self.amp = float(self.control_params['amp'])
+        self.phase = float(self.control_params['phase'])
+        self.fsrc = float(self.control_params['fsrc'])
+        self.rot = np.exp(1j * 2.0 * np.pi * self.fsrc * self.Ts)  # Source phase step
+        ib = float(self.control_params['ib'])
+        if ib != self.ib:
+            self.ib = ib
+            self.ib_dirty = True
+        self.pulsed = bool(self.control_params['pulsed'])
+        self.gain_dB = float(self.control_params['gain_dB'])
+        self.gain_lin = 10.0 ** (self.gain_dB / 20.0)  # Linear amplifier gain
     
     def setup_gui(self):
         """Setup the main GUI layout"""
@@ -273,6 +414,9 @@ class CavitySimulationGUI:
         
         self.data_points_label = ttk.Label(status_frame, text="Data Points: 0")
         self.data_points_label.pack()
+        
+        self.drift_label = ttk.Label(status_frame, text="Behind Schedule: 0.0 ms")
+        self.drift_label.pack()
     
     def setup_plot_area(self):
         """Setup the plot area with multiple subplots"""
@@ -304,7 +448,7 @@ class CavitySimulationGUI:
         self.ax4.grid(True)
         
         self.ax5.set_title('Mechanical Modes')
-        self.ax5.set_ylabel('Amplitude')
+        self.ax5.set_ylabel('Detuning (rad/s)')
         self.ax5.grid(True)
         
         self.ax6.set_title('Parameter Scan Results')
@@ -314,8 +458,18 @@ class CavitySimulationGUI:
         # Initialize plot lines
         self.init_plot_lines()
         
+        # Blitting state: axes backgrounds are captured after every full redraw
+        self.live_axes = [(self.ax1, [self.line1]), (self.ax2, [self.line2]),
+                          (self.ax3, [self.line3]), (self.ax4, [self.line4]),
+                          (self.ax5, self.mech_lines)]
+        self.axes_backgrounds = []
+        self.full_redraw_interval = 20  # Rescale axes every N plot updates
+        self.mech_update_interval = 10  # Mechanical modes are slow, refresh every N plot updates
+        self.plot_count = 0
+        
         # Create canvas
         self.canvas = FigureCanvasTkAgg(self.fig, self.plot_frame)
+        self.canvas.mpl_connect('draw_event', self.on_draw)
         self.canvas.draw()
         self.canvas.get_tk_widget().pack(fill=tk.BOTH, expand=True)
         
@@ -327,232 +481,164 @@ class CavitySimulationGUI:
     
     def init_plot_lines(self):
         """Initialize plot lines"""
-        self.line1, = self.ax1.plot([], [], 'b-', linewidth=1)
-        self.line2, = self.ax2.plot([], [], 'r-', linewidth=1)
-        self.line3, = self.ax3.plot([], [], 'g-', linewidth=1)
-        self.line4, = self.ax4.plot([], [], 'm-', linewidth=1)
+        self.line1, = self.ax1.plot([], [], 'b-', linewidth=1, animated=True)
+        self.line2, = self.ax2.plot([], [], 'r-', linewidth=1, animated=True)
+        self.line3, = self.ax3.plot([], [], 'g-', linewidth=1, animated=True)
+        self.line4, = self.ax4.plot([], [], 'm-', linewidth=1, animated=True)
         
         # Mechanical mode lines
         self.mech_lines = []
         colors = ['c', 'y', 'k', 'orange', 'purple']
         for i in range(len(self.mech_modes['f'])):
-            line, = self.ax5.plot([], [], colors[i % len(colors)], 
-                                 linewidth=1, label=f'Mode {i+1} ({self.mech_modes["f"][i]} Hz)')
+            line, = self.ax5.plot([], [], colors[i % len(colors)], linewidth=1, animated=True,
+                                 label=f'Mode {i+1} ({self.mech_modes["f"][i]} Hz)')
             self.mech_lines.append(line)
         self.ax5.legend()
         
         self.scan_line, = self.ax6.plot([], [], 'ro-', linewidth=1)
     
-    def sim_helper_functions(self):
-        """Simulation helper functions"""
-        def sim_rfsrc(fsrc, Asrc, pha_src, Ts):
-            pha = pha_src + 2.0 * np.pi * fsrc * Ts
-            return Asrc*np.exp(1j*pha), pha
-        
-        def sim_iqmod(sig_in, pulsed=True, base_pul=None, base_cw=0, buf_id=0):
-            if pulsed:
-                sig_out = sig_in * base_pul[buf_id if buf_id < len(base_pul) else -1]
-            else:
-                sig_out = sig_in * base_cw
-            return sig_out
-        
-        def sim_amp(sig_in, gain_dB):
-            return sig_in * 10.0**(gain_dB / 20.0)
-        
-        def sim_cav(half_bw, RL, dw_step0, detuning0, vf_step, state_vc, Ts, beta=1e4,
-                    state_m0=0, Am=None, Bm=None, Cm=None, Dm=None,
-                    pulsed=True, beam_pul=None, beam_cw=0, buf_id=0):
-            # get the beam
-            if pulsed:
-                vb = -RL * beam_pul[buf_id if buf_id < len(beam_pul) else -1]
-            else:
-                vb = -RL * beam_cw
-            
-            # execute for one step
-            status, vc, vr, dw, state_m = sim_scav_step(half_bw,
-                                                        dw_step0,
-                                                        detuning0, 
-                                                        vf_step, 
-                                                        vb, 
-                                                        state_vc, 
-                                                        Ts, 
-                                                        beta=beta,
-                                                        state_m0=state_m0, 
-                                                        Am=Am, 
-                                                        Bm=Bm, 
-                                                        Cm=Cm, 
-                                                        Dm=Dm,
-                                                        mech_exe=True)           
-            state_vc = vc
-            
-            # return 
-            return vc, vr, dw, state_vc, state_m
-        
-        return sim_rfsrc, sim_iqmod, sim_amp, sim_cav
-    
-    def simulation_step(self):
-        """Execute one simulation step"""
-        sim_rfsrc, sim_iqmod, sim_amp, sim_cav = self.sim_helper_functions()
-        
-        # Get current parameters
-        params = self.control_params.copy()
-        
+    def simulation_batch(self, n_steps):
+        """Execute n_steps simulation steps in one compiled call"""
         # Update beam profile if needed
-        self.beam_pul[self.t_fill:self.t_flat] = params['ib']
-        
-        # RF signal source
-        S0, self.pha_src = sim_rfsrc(params['fsrc'], params['amp'], self.pha_src, self.Ts)
-        
-        # emulate the pulse
-        if params['pulsed']:
-            self.buf_id += 1
-            if self.buf_id >= self.pul_len:
-                self.buf_id = 0
-        
-        # I/Q modulator
-        S1 = sim_iqmod(S0, 
-                       pulsed=params['pulsed'],
-                       base_pul=self.base_pul,
-                       base_cw=self.base_cw,
-                       buf_id=self.buf_id)
-        
-        # Amplifier
-        S2 = sim_amp(S1, params['gain_dB'])
-        
-        # Microphonics
-        dw_micr = 2.0 * np.pi * np.random.randn() * 10
-        
-        # Cavity dynamics
-        vc, vr, self.dw, self.state_vc, self.state_m = sim_cav(
-            self.wh, self.RL, self.dw, 0 + dw_micr, S2, self.state_vc, self.Ts, 
-            beta=self.beta,
-            state_m0=self.state_m, 
-            Am=self.Ad, 
-            Bm=self.Bd, 
-            Cm=self.Cd,
-            Dm=self.Dd,
-            pulsed=params['pulsed'], 
-            beam_pul=self.beam_pul, 
-            beam_cw=self.beam_cw, 
-            buf_id=self.buf_id)
-        
-        return vc, vr, self.dw
+        if self.ib_dirty:
+            self.ib_dirty = False
+            self.beam_pul[self.t_fill:self.t_flat] = self.ib
+        
+        vc = self.batch_vc[:n_steps]
+        vr = self.batch_vr[:n_steps]
+        dw = self.batch_dw[:n_steps]
+        mech = self.batch_mech[:n_steps]
+        
+        # Microphonics for the whole batch
+        dw_micr = self.rng.standard_normal(n_steps) * self.micr_scale
+        
+        self.phasor, self.buf_id, self.dw, self.state_vc = step_batch(
+            n_steps, self.phasor, self.rot, self.amp, self.Ts,
+            self.pulsed, self.pul_len, self.base_pul, self.base_cw, self.buf_id,
+            self.gain_lin, self.wh, self.RL, self.beta, self.dw, dw_micr, self.beam_pul,
+            self.beam_cw, self.state_vc, self.state_m, self.Ad, self.Bd, self.Cd,
+            self.Dd, vc, vr, dw, mech)
+        
+        return vc, vr, dw, mech
     
     def simulation_loop(self):
         """Main simulation loop"""
-        start_time = time.time()
-        step_count = 0
+        step_period_ns = round(self.Ts * self.realtime_factor * 1e9)  # Wall-clock time per step
+        start_ns = time.perf_counter_ns()
+        next_deadline_ns = start_ns
+        last_time = 0.0
         
         while self.simulation_running:
             if not self.playback_mode:
-                # Run simulation step
-                vc, vr, dw = self.simulation_step()
-                current_time = time.time() - start_time
+                # Run a batch of simulation steps
+                vc, vr, dw, mech = self.simulation_batch(self.batch_size)
+                current_time = (time.perf_counter_ns() - start_ns) * 1e-9
                 
-                # Store data
-                self.store_data(current_time, vc, vr, dw)
+                # Store data, spreading the batch over the elapsed wall-clock time
+                times = np.linspace(last_time, current_time, self.batch_size + 1)[1:]
+                self.store_batch(times, vc, vr, dw, mech)
+                last_time = current_time
                 
-                step_count += 1
+                # Pace against the wall-clock deadline, sleeping only when more than 1 ms ahead
+                next_deadline_ns += self.batch_size * step_period_ns
+                slack_ns = next_deadline_ns - time.perf_counter_ns()
                 
-                # Update GUI every 100 steps
-                if step_count % 100 == 0:
-                    self.root.after(0, self.update_plots)
-                    self.root.after(0, self.update_status, current_time, len(self.history_data['time']))
+                # Update GUI once per batch
+                self.root.after(0, self.update_plots)
+                self.root.after(0, self.update_status, current_time, len(self.history),
+                                max(0, -slack_ns) * 1e-6)
+                
+                if slack_ns > 1_000_000:
+                    time.sleep(slack_ns * 1e-9)
             else:
-                # Playback mode
+                # Playback mode: the slider owns the plots, so only idle here
                 time.sleep(0.01)
-                self.root.after(0, self.update_plots)
-            
-            time.sleep(self.Ts * 100)  # Adjust timing for GUI responsiveness
-    
-    def store_data(self, current_time, vc, vr, dw):
-        """Store simulation data"""
-        # Limit history size
-        if len(self.history_data['time']) >= self.max_history:
-            for key in self.history_data:
-                if key != 'mech_modes' and key != 'control_params':
-                    self.history_data[key].pop(0)
-                elif key == 'mech_modes':
-                    for mode_data in self.history_data[key]:
-                        if mode_data:
-                            mode_data.pop(0)
-                elif key == 'control_params':
-                    for param_data in self.history_data[key].values():
-                        if param_data:
-                            param_data.pop(0)
-        
-        # Store new data
-        self.history_data['time'].append(current_time)
-        self.history_data['vc_real'].append(np.real(vc))
-        self.history_data['vc_imag'].append(np.imag(vc))
-        self.history_data['vc_mag'].append(np.abs(vc))
-        self.history_data['vc_phase'].append(np.angle(vc) * 180 / np.pi)
-        self.history_data['vr_real'].append(np.real(vr))
-        self.history_data['vr_imag'].append(np.imag(vr))
-        self.history_data['vr_mag'].append(np.abs(vr))
-        self.history_data['vr_phase'].append(np.angle(vr) * 180 / np.pi)
-        self.history_data['detuning'].append(dw / (2 * np.pi))
+                next_deadline_ns = time.perf_counter_ns()
+    
+    def store_batch(self, times, vc, vr, dw, mech):
+        """Store a batch of simulation data"""
+        history = self.history
+        idx = (history.write_idx + np.arange(len(times))) % history.capacity
+        
+        # Store new data, overwriting the oldest samples once the buffer is full
+        history.data['time'][idx] = times
+        history.data['vc'][idx] = vc
+        history.data['vr'][idx] = vr
+        history.data['detuning'][idx] = dw / (2 * np.pi)
         
         # Store mechanical mode data
-        for i in range(len(self.mech_modes['f'])):
-            try:
-                mode_val = np.real(self.state_m[0, i])
-                self.history_data['mech_modes'][i].append(mode_val)
-            except:
-                self.history_data['mech_modes'][i].append(0)
+        history.mech_modes[:, idx] = mech.T
         
         # Store control parameters if recording
-        if self.recording:
-            for param, value in self.control_params.items():
-                self.history_data['control_params'][param].append(value)
+        for param, param_data in history.control_params.items():
+            param_data[idx] = self.control_params[param] if self.recording else np.nan
+        
+        history.advance(len(times))
+    
+    def on_draw(self, event):
+        """Capture the axes backgrounds after a full redraw and draw the live lines on top"""
+        self.axes_backgrounds = [self.canvas.copy_from_bbox(ax.bbox) for ax, _ in self.live_axes]
+        for ax, lines in self.live_axes:
+            for line in lines:
+                ax.draw_artist(line)
+    
+    def blit_plots(self, include_mech=True):
+        """Redraw only the live lines over the cached axes backgrounds"""
+        for (ax, lines), background in zip(self.live_axes, self.axes_backgrounds):
+            if ax is self.ax5 and not include_mech:
+                continue
+            self.canvas.restore_region(background)
+            for line in lines:
+                ax.draw_artist(line)
+            self.canvas.blit(ax.bbox)
     
-    def update_plots(self):
+    def plot_traces(self):
+        """Return the plotted traces (time, |vc| MV, vc phase deg, |vr| MV, detuning), oldest first"""
+        time_data = self.history.get_ordered('time')
+        vc_data = self.history.get_ordered('vc')
+        return (time_data,
+                np.abs(vc_data) * 1e-6,  # Convert to MV
+                np.angle(vc_data, deg=True),
+                np.abs(self.history.get_ordered('vr')) * 1e-6,  # Convert to MV
+                self.history.get_ordered('detuning'))
+    
+    def show_traces(self, time_data, vc_mag_data, vc_phase_data, vr_mag_data, detuning_data,
+                    mech_data=None, rescale=False):
+        """Set the line data and redraw, rescaling the axes or blitting the lines"""
+        # Voltages keep their min/max envelope, detuning is strided
+        self.line1.set_data(*decimate_envelope(time_data, vc_mag_data))
+        self.line2.set_data(*decimate_envelope(time_data, vc_phase_data))
+        self.line3.set_data(*decimate_envelope(time_data, vr_mag_data))
+        self.line4.set_data(*decimate(time_data, detuning_data))
+        
+        # Mechanical modes are only updated when given
+        if mech_data is not None:
+            mech_time, mech_data = decimate(time_data, mech_data)
+            for line, mode_data in zip(self.mech_lines, mech_data):
+                line.set_data(mech_time, mode_data)
+        
+        if rescale:
+            for ax, _ in self.live_axes:
+                ax.relim()
+                ax.autoscale_view()
+            self.canvas.draw()
+        else:
+            self.blit_plots(include_mech=mech_data is not None)
+    
+    def update_plots(self, rescale=None):
         """Update all plots with current data"""
-        if not self.history_data['time']:
+        # Leave the slider-positioned playback view alone, including updates queued before it started
+        if not len(self.history) or self.playback_traces is not None:
             return
         
         try:
-            time_data = np.array(self.history_data['time'])
-            
-            # Update cavity voltage magnitude
-            if self.history_data['vc_mag']:
-                vc_mag_data = np.array(self.history_data['vc_mag'], dtype=float) * 1e-6  # Convert to MV
-                self.line1.set_data(time_data, vc_mag_data)
-                self.ax1.relim()
-                self.ax1.autoscale_view()
-            
-            # Update cavity voltage phase
-            if self.history_data['vc_phase']:
-                vc_phase_data = np.array(self.history_data['vc_phase'], dtype=float)
-                self.line2.set_data(time_data, vc_phase_data)
-                self.ax2.relim()
-                self.ax2.autoscale_view()
-            
-            # Update reflected voltage
-            if self.history_data['vr_mag']:
-                vr_mag_data = np.array(self.history_data['vr_mag'], dtype=float) * 1e-6  # Convert to MV
-                self.line3.set_data(time_data, vr_mag_data)
-                self.ax3.relim()
-                self.ax3.autoscale_view()
-            
-            # Update detuning
-            if self.history_data['detuning']:
-                detuning_data = np.array(self.history_data['detuning'], dtype=float)
-                self.line4.set_data(time_data, detuning_data)
-                self.ax4.relim()
-                self.ax4.autoscale_view()
-            
-            # Update mechanical modes
-            for i, line in enumerate(self.mech_lines):
-                if (i < len(self.history_data['mech_modes']) and 
-                    self.history_data['mech_modes'][i] and 
-                    len(self.history_data['mech_modes'][i]) == len(time_data)):
-                    mech_data = np.array(self.history_data['mech_modes'][i], dtype=float)
-                    line.set_data(time_data, mech_data)
-            self.ax5.relim()
-            self.ax5.autoscale_view()
-            
-            self.canvas.draw_idle()
+            # Mechanical modes at a reduced rate, full redraw with rescaling periodically
+            update_mech = self.plot_count % self.mech_update_interval == 0
+            if rescale is None:
+                rescale = self.plot_count % self.full_redraw_interval == 0
+            mech_data = self.history.ordered(self.history.mech_modes) if update_mech or rescale else None
+            self.show_traces(*self.plot_traces(), mech_data, rescale=rescale)
+            self.plot_count += 1
             
         except Exception as e:
             print(f"Plot update error: {e}")
@@ -565,6 +651,7 @@ class CavitySimulationGUI:
         self.control_params['fsrc'] = self.fsrc_var.get()
         self.control_params['ib'] = self.ib_var.get()
         self.control_params['pulsed'] = self.pulsed_var.get()
+        self.apply_control_params()
         
         # Update labels
         self.amp_label.config(text=f"Value: {self.amp_var.get():.3f}")
@@ -572,10 +659,11 @@ class CavitySimulationGUI:
         self.fsrc_label.config(text=f"Value: {self.fsrc_var.get():.0f}")
         self.ib_label.config(text=f"Value: {self.ib_var.get():.4f}")
     
-    def update_status(self, sim_time, data_points):
+    def update_status(self, sim_time, data_points, drift_ms=0.0):
         """Update status labels"""
         self.sim_time_label.config(text=f"Sim Time: {sim_time:.3f} s")
         self.data_points_label.config(text=f"Data Points: {data_points}")
+        self.drift_label.config(text=f"Behind Schedule: {drift_ms:.1f} ms")
     
     def start_simulation(self):
         """Start the simulation"""
@@ -601,22 +689,16 @@ class CavitySimulationGUI:
         self.stop_simulation()
         
         # Reset states
-        self.state_m = np.matrix(np.zeros(self.Bd.shape))
+        self.state_m = np.zeros(self.Bd.shape[0], dtype=np.float64)
         self.state_vc = 0.0
-        self.pha_src = 0.0
+        self.phasor = 1.0 + 0.0j
         self.buf_id = 0
         self.dw = 0
+        self.rng = np.random.default_rng(self.seed)
         
         # Clear history
-        for key in self.history_data:
-            if key != 'mech_modes' and key != 'control_params':
-                self.history_data[key].clear()
-            elif key == 'mech_modes':
-                for mode_data in self.history_data[key]:
-                    mode_data.clear()
-            elif key == 'control_params':
-                for param_data in self.history_data[key].values():
-                    param_data.clear()
+        self.stop_playback()
+        self.history.clear()
         
         # Clear plots
         for line in [self.line1, self.line2, self.line3, self.line4] + self.mech_lines + [self.scan_line]:
@@ -640,7 +722,7 @@ class CavitySimulationGUI:
     
     def save_data(self):
         """Save recorded data to file"""
-        if not self.history_data['time']:
+        if not len(self.history):
             messagebox.showwarning("Warning", "No data to save!")
             return
         
@@ -663,35 +745,21 @@ class CavitySimulationGUI:
                                 'mech_modes': self.mech_modes
                             }
                         },
-                        'data': self.history_data
+                        'data': self.history.to_dict()
                     }
                     with open(filename, 'w') as f:
                         json.dump(save_data, f, indent=2, default=str)
                 else:
                     # Save as CSV
-                    with open(filename, 'w', newline='') as f:
-                        writer = csv.writer(f)
-                        
-                        # Write header
-                        header = ['time', 'vc_mag', 'vc_phase', 'vr_mag', 'detuning']
-                        header.extend([f'mech_mode_{i+1}' for i in range(len(self.mech_modes['f']))])
-                        writer.writerow(header)
-                        
-                        # Write data
-                        for i in range(len(self.history_data['time'])):
-                            row = [
-                                self.history_data['time'][i],
-                                self.history_data['vc_mag'][i],
-                                self.history_data['vc_phase'][i],
-                                self.history_data['vr_mag'][i],
-                                self.history_data['detuning'][i]
-                            ]
-                            for j in range(len(self.mech_modes['f'])):
-                                if i < len(self.history_data['mech_modes'][j]):
-                                    row.append(self.history_data['mech_modes'][j][i])
-                                else:
-                                    row.append(0)
-                            writer.writerow(row)
+                    header = ['time', 'vc_mag', 'vc_phase', 'vr_mag', 'detuning']
+                    header.extend([f'mech_mode_{i+1}' for i in range(len(self.mech_modes['f']))])
+                    
+                    export = self.history.export_columns()
+                    columns = np.column_stack(
+                        [export[key] for key in header[:5]] +
+                        list(self.history.ordered(self.history.mech_modes)))
+                    np.savetxt(filename, columns, delimiter=',', header=','.join(header),
+                               comments='', fmt='%.10g')
                 
                 messagebox.showinfo("Success", f"Data saved to {filename}")
                 
@@ -705,62 +773,83 @@ class CavitySimulationGUI:
         )
         
         if filename:
-            try:
-                if filename.endswith('.json'):
-                    # Load JSON
-                    with open(filename, 'r') as f:
-                        loaded_data = json.load(f)
-                    self.history_data = loaded_data['data']
-                else:
-                    # Load CSV
-                    self.history_data = {
-                        'time': [], 'vc_real': [], 'vc_imag': [], 'vc_mag': [], 'vc_phase': [],
-                        'vr_real': [], 'vr_imag': [], 'vr_mag': [], 'vr_phase': [],
-                        'detuning': [],
-                        'mech_modes': [[] for _ in range(len(self.mech_modes['f']))],
-                        'control_params': {'amp': [], 'phase': [], 'fsrc': [], 'pulsed': []}
-                    }
-                    
-                    with open(filename, 'r') as f:
-                        reader = csv.reader(f)
-                        header = next(reader)  # Skip header
-                        
-                        for row in reader:
-                            self.history_data['time'].append(float(row[0]))
-                            self.history_data['vc_mag'].append(float(row[1]))
-                            self.history_data['vc_phase'].append(float(row[2]))
-                            self.history_data['vr_mag'].append(float(row[3]))
-                            self.history_data['detuning'].append(float(row[4]))
-                            
-                            for i in range(len(self.mech_modes['f'])):
-                                if i + 5 < len(row):
-                                    self.history_data['mech_modes'][i].append(float(row[i + 5]))
-                
-                self.update_plots()
-                messagebox.showinfo("Success", f"Data loaded from {filename}")
-                
-            except Exception as e:
-                messagebox.showerror("Error", f"Failed to load data: {str(e)}")
+            # Parse in a separate thread so the GUI stays responsive
+            self.status_label.config(text="Loading data...")
+            load_thread = threading.Thread(target=self.read_data_file, args=(filename,), daemon=True)
+            load_thread.start()
+    
+    def read_data_file(self, filename):
+        """Parse a saved data file in the background and hand the result to the GUI thread"""
+        try:
+            if filename.endswith('.json'):
+                # Load JSON
+                with open(filename, 'r') as f:
+                    loaded_data = json.load(f)
+                data = loaded_data['data']
+                loaded = (data, data.get('mech_modes'), data.get('control_params'))
+            else:
+                # Load CSV, one column per field
+                data = np.loadtxt(filename, delimiter=',', skiprows=1, ndmin=2)
+                keys = ['time', 'vc_mag', 'vc_phase', 'vr_mag', 'detuning']
+                columns = {key: data[:, i] for i, key in enumerate(keys)}
+                mech_modes = data[:, len(keys):len(keys) + len(self.mech_modes['f'])].T
+                loaded = (columns, mech_modes, None)
+            
+            self.root.after(0, self.install_data, filename, *loaded)
+            
+        except Exception as e:
+            self.root.after(0, self.load_failed, e)
+    
+    def install_data(self, filename, columns, mech_modes, control_params):
+        """Replace the history with loaded data (runs in the GUI thread)"""
+        try:
+            # Playback traces belong to the replaced history
+            self.stop_playback()
+            self.history.load(columns, mech_modes, control_params)
+            self.update_plots(rescale=True)
+            self.status_label.config(text="Data loaded")
+            messagebox.showinfo("Success", f"Data loaded from {filename}")
+            
+        except Exception as e:
+            self.load_failed(e)
+    
+    def load_failed(self, error):
+        """Report a failed data load"""
+        self.status_label.config(text="Load failed")
+        messagebox.showerror("Error", f"Failed to load data: {str(error)}")
     
     def toggle_playback(self):
         """Toggle playback mode"""
-        if not self.history_data['time']:
+        if not len(self.history):
             messagebox.showwarning("Warning", "No data to playback!")
             return
         
         self.playback_mode = not self.playback_mode
         if self.playback_mode:
             self.playback_btn.config(text="Stop Playback")
-            self.playback_scale.config(to=len(self.history_data['time'])-1)
+            self.playback_scale.config(to=len(self.history)-1)
+            
+            # Compute the traces once and frame the axes on the whole history
+            self.playback_traces = self.plot_traces() + (self.history.ordered(self.history.mech_modes),)
+            self.show_traces(*self.playback_traces, rescale=True)
         else:
-            self.playback_btn.config(text="Start Playback")
+            self.stop_playback()
+            self.update_plots(rescale=True)
+    
+    def stop_playback(self):
+        """Leave playback mode and drop its precomputed traces"""
+        self.playback_mode = False
+        self.playback_traces = None
+        self.playback_btn.config(text="Start Playback")
     
     def set_playback_position(self, *args):
         """Set playback position"""
-        if self.playback_mode and self.history_data['time']:
+        if self.playback_mode and self.playback_traces is not None:
             self.playback_index = int(self.playback_var.get())
-            # Update plots to show data up to current position
-            # This could be implemented to show progressive playback
+            
+            # Show the data up to the current position, blitting over the fixed axes
+            end = self.playback_index + 1
+            self.show_traces(*(trace[..., :end] for trace in self.playback_traces))
     
     def start_parameter_scan(self):
         """Start parameter scanning"""
@@ -772,56 +861,73 @@ class CavitySimulationGUI:
             messagebox.showerror("Error", "Minimum value must be less than maximum value!")
             return
         
-        # Run scan in separate thread
+        # Run scan in separate thread, one at a time: the parallel scan kernel
+        # must not be entered from two threads at once
+        self.scan_btn.config(state='disabled')
         scan_thread = threading.Thread(target=self.parameter_scan, 
                                        args=(param, min_val, max_val), daemon=True)
         scan_thread.start()
     
     def parameter_scan(self, param, min_val, max_val):
         """Execute parameter scanning"""
-        num_points = 20
-        param_values = np.linspace(min_val, max_val, num_points)
-        responses = []
-        
-        # Store original parameter value
-        original_value = self.control_params[param]
-        
-        self.root.after(0, lambda: self.status_label.config(text=f"Scanning {param}..."))
-        
-        for i, value in enumerate(param_values):
-            # Set parameter value
-            self.control_params[param] = value
+        try:
+            num_points = 20
+            num_steps = 100  # Steps per point to approach steady state
+            param_values = np.linspace(min_val, max_val, num_points)
             
-            # Run simulation for a short time to get steady state
-            temp_state_vc = 0.0
-            temp_state_m = np.matrix(np.zeros(self.Bd.shape))
+            self.root.after(0, lambda: self.status_label.config(text=f"Scanning {param}..."))
             
-            for _ in range(100):  # Run 100 steps
-                vc, vr, dw = self.simulation_step()
+            # Per-point parameters; every point starts from the current simulation state
+            point_params = {key: np.full(num_points, getattr(self, key)) for key in ('amp', 'fsrc', 'ib')}
+            if param in point_params:
+                point_params[param] = param_values
+            beam_puls = np.zeros((num_points, self.buf_size), dtype=complex)
+            beam_puls[:, self.t_fill:self.t_flat] = point_params['ib'][:, None]
             
-            # Record response (cavity voltage magnitude)
-            responses.append(np.abs(vc) * 1e-6)  # Convert to MV
+            # The same microphonics sequence for every point, so only the scanned parameter differs;
+            # drawn from a generator of its own so scans repeat for a given seed and leave the
+            # live simulation's noise stream untouched
+            scan_rng = np.random.default_rng(self.seed)
+            dw_micr = scan_rng.standard_normal(num_steps) * self.micr_scale
             
-            # Update progress
-            progress = (i + 1) / num_points * 100
-            self.root.after(0, lambda p=progress: self.status_label.config(text=f"Scanning {param}... {p:.0f}%"))
-        
-        # Restore original parameter value
-        self.control_params[param] = original_value
-        
-        # Update scan plot
-        self.root.after(0, self.update_scan_plot, param_values, responses, param)
-        self.root.after(0, lambda: self.status_label.config(text="Scan complete"))
+            common = (self.phasor, self.Ts, self.pulsed, self.pul_len, self.base_pul,
+                      self.base_cw, self.buf_id, self.gain_lin, self.wh,
+                      self.RL, self.beta, self.dw, dw_micr, self.beam_cw, self.state_vc,
+                      self.state_m.copy(), self.Ad, self.Bd, self.Cd, self.Dd)
+            
+            if NUMBA_AVAILABLE:
+                # Compiled kernel runs the points in parallel threads
+                results = scan_kernel(num_steps, point_params['amp'], point_params['fsrc'],
+                                      beam_puls, *common)
+            else:
+                # Without Numba, step all points together with vectorized NumPy
+                results = scan_lockstep(num_steps, point_params['amp'], point_params['fsrc'],
+                                        beam_puls, *common)
+            
+            # Record response (cavity voltage magnitude, MV)
+            responses = results[:, 0]
+            
+            # Update scan plot
+            self.root.after(0, self.update_scan_plot, param_values, responses, param)
+            self.root.after(0, lambda: self.status_label.config(text="Scan complete"))
+        finally:
+            self.root.after(0, lambda: self.scan_btn.config(state='normal'))
     
     def update_scan_plot(self, param_values, responses, param_name):
         """Update parameter scan plot"""
         self.scan_line.set_data(param_values, responses)
-        self.ax6.relim()
-        self.ax6.autoscale_view()
+        
+        # Limits are known from the scan itself, so skip relim/autoscale
+        x_lo, x_hi = np.min(param_values), np.max(param_values)
+        y_lo, y_hi = np.min(responses), np.max(responses)
+        y_pad = 0.05 * (y_hi - y_lo) or 0.05 * max(abs(y_hi), 1.0)
+        if x_hi > x_lo:
+            self.ax6.set_xlim(x_lo, x_hi)
+        self.ax6.set_ylim(y_lo - y_pad, y_hi + y_pad)
         self.ax6.set_xlabel(f'{param_name}')
         self.ax6.set_ylabel('Cavity Voltage (MV)')
         self.ax6.set_title(f'Parameter Scan: {param_name}')
-        self.canvas.draw()
+        self.canvas.draw_idle()
 
 def main():
     root = tk.Tk()
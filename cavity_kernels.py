@@ -0,0 +1,497 @@
+#!/usr/bin/env python3
+"""
+Virtual Cavity Simulator - Compiled Simulation Kernels
+
+Project: Virtual Cavity RF Simulator
+Author: Ming Liu (mliu@ihep.ac.cn)
+Institution: Institute of High Energy Physics, Chinese Academy of Sciences
+Created: 2026-10-15
+Version: Unreleased (after 1.0.0)
+
+Description:
+    Numerical kernels for the per-step RF cavity simulation. The kernels
+    reproduce the LLRFLibsPy signal chain (RF source, I/Q modulator,
+    amplifier and sim_scav_step cavity update) on plain ndarrays so that
+    they can be compiled with Numba.
+
+Features:
+    - Fused RF source / modulator / amplifier / cavity step
+    - Batched stepping with output written to preallocated arrays
+    - Parallel parameter scan over independent sweep points
+    - Vectorized lockstep parameter scan for NumPy-only installs
+    - Ensemble of independent microphonics realizations, on the GPU with CuPy
+    - Whole-loop cavity simulation for the scripted examples and the standalone script
+    - Parallel batch of independent whole-loop runs for parameter sweeps
+    - Modal (block-diagonal) realization of the llrflibs mechanical model with
+      exact ZOH discretization, cached in memory and on disk per (modes, Ts)
+    - Mechanical mode state-space update on contiguous ndarrays
+    - Transparent fallback to pure Python when Numba is not installed
+      (run_cavity uses the Cython build in cavity_kernels_cy when present)
+
+Dependencies:
+    - numpy: Numerical computing
+    - numba: JIT compilation (optional)
+    - cython: Static build of run_cavity without Numba (optional)
+    - cupy: GPU arrays for the ensemble simulation (optional)
+    - scipy: Matrix exponential for the zero-order-hold discretization
+
+License:
+    MIT License - see LICENSE file for details
+
+Changelog:
+    Unreleased (2026-10-15): Added with the Numba step kernels, the optional
+        Cython and CuPy paths and the cached ZOH discretization
+"""
+import functools
+import hashlib
+import math
+import os
+
+import numpy as np
+
+try:
+    from numba import njit, prange
+    NUMBA_AVAILABLE = True
+except ImportError:
+    NUMBA_AVAILABLE = False
+    prange = range
+
+    def njit(*args, **kwargs):
+        """Fallback decorator returning the function unchanged"""
+        if len(args) == 1 and callable(args[0]) and not kwargs:
+            return args[0]
+
+        def decorator(func):
+            return func
+        return decorator
+
+try:
+    import cupy
+    CUPY_AVAILABLE = True
+except ImportError:
+    CUPY_AVAILABLE = False
+
+# Directory for discretized mechanical models reused across runs. The VCS_CACHE_DIR
+# environment variable overrides it, and an empty value (or None here) disables it.
+MECH_CACHE_DIR = os.environ.get(
+    'VCS_CACHE_DIR', os.path.join(os.path.expanduser('~'), '.cache', 'virtual-cavity-simulator')) or None
+
+# Part of every cache key; bump it whenever the model or its discretization changes
+MECH_CACHE_VERSION = 2
+
+
+def mech_state_space(mech_modes, Ts):
+    """
+    Return the discrete mechanical state-space matrices (Ad, Bd, Cd, Dd).
+
+    The discretization is computed once per mode set and time step and reused
+    afterwards, across runs through the .npz files in MECH_CACHE_DIR (VCS_CACHE_DIR).
+    The matrices are contiguous float64 ndarrays ready for the kernels. The
+    model is modal: state 2*i is the detuning (rad/s) contributed by mode i and
+    state 2*i + 1 its time derivative, so state_m[::2] holds the per-mode detuning.
+    """
+    mech_key = tuple((name, tuple(values)) for name, values in sorted(mech_modes.items()))
+    return tuple(m.copy() for m in discretize_mech(mech_key, Ts))
+
+
+@functools.lru_cache(maxsize=None)
+def discretize_mech(mech_key, Ts):
+    """Discretize the mechanical modes given as a hashable ((name, values), ...) key"""
+    cache_file = None
+    if MECH_CACHE_DIR:
+        digest = hashlib.sha1(repr((MECH_CACHE_VERSION, mech_key, Ts)).encode()).hexdigest()
+        cache_file = os.path.join(MECH_CACHE_DIR, f'ssdisc_v{MECH_CACHE_VERSION}_{digest}.npz')
+        try:
+            with np.load(cache_file) as cached:
+                return tuple(cached[name] for name in ('Ad', 'Bd', 'Cd', 'Dd'))
+        except Exception:
+            # Missing, empty (EOFError), truncated (BadZipFile) or otherwise unreadable:
+            # recompute the model below and overwrite the file
+            pass
+
+    from scipy.linalg import expm
+
+    mech_modes = dict(mech_key)
+    fm, Qm, Km = mech_modes['f'], mech_modes['Q'], mech_modes['K']
+    if not (len(fm) >= 1 and len(fm) == len(Qm) == len(Km)):
+        raise ValueError("mech_modes needs matching, non-empty 'f', 'Q' and 'K' lists")
+
+    # Modal realization of the llrflibs cav_ss_mech transfer function
+    # sum_i -K_i*w_i^2 / (s^2 + w_i/Q_i*s + w_i^2): one [x, dx/dt] block per mode,
+    # where x is the detuning (rad/s) contributed by that mode. Unlike the companion
+    # form that cav_ss_mech gets from tf2ss, it keeps the modes apart and is well
+    # conditioned.
+    nx, nu = 2 * len(fm), 1
+    Am = np.zeros((nx, nx))
+    Bm = np.zeros((nx, nu))
+    Cm = np.zeros((1, nx))
+    Dm = np.zeros((1, nu))
+    for i, (f, Q, K) in enumerate(zip(fm, Qm, Km)):
+        w = 2.0 * np.pi * f
+        Am[2 * i, 2 * i + 1] = 1.0
+        Am[2 * i + 1, 2 * i] = -w * w
+        Am[2 * i + 1, 2 * i + 1] = -w / Q
+        Bm[2 * i + 1, 0] = -K * w * w
+        Cm[0, 2 * i] = 1.0
+
+    # Exact zero-order hold: expm([[A, B], [0, 0]]*Ts) = [[Ad, Bd], [0, I]]
+    M = np.zeros((nx + nu, nx + nu))
+    M[:nx, :nx] = Am
+    M[:nx, nx:] = Bm
+    E = expm(M * Ts)
+    Ad, Bd = E[:nx, :nx], E[:nx, nx:]
+    Ad, Bd, Cd, Dd = (np.ascontiguousarray(m, dtype=np.float64) for m in (Ad, Bd, Cm, Dm))
+
+    # Write through a temporary file so a concurrent reader never sees a partial file
+    if cache_file:
+        tmp_file = f'{cache_file}.{os.getpid()}.tmp'
+        try:
+            os.makedirs(MECH_CACHE_DIR, exist_ok=True)
+            with open(tmp_file, 'wb') as f:
+                np.savez(f, Ad=Ad, Bd=Bd, Cd=Cd, Dd=Dd)
+            os.replace(tmp_file, cache_file)
+        except OSError:
+            # The disk cache is optional; just do not leave a partial file behind
+            try:
+                os.remove(tmp_file)
+            except OSError:
+                pass
+    return Ad, Bd, Cd, Dd
+
+
+@njit(cache=True)
+def drive_gains(half_bw, Ts, beta):
+    """
+    Return the forward and beam voltage gains of the cavity update for a run.
+
+    The cavity equation drives the voltage with 2*half_bw*Ts*(beta/(beta+1)*vf + vb);
+    both factors are constant for a run and are computed once here.
+    """
+    if not (math.isfinite(beta) and beta >= 0.0):
+        raise ValueError("beta must be a finite, non-negative coupling factor")
+    c_vb = 2.0 * half_bw * Ts
+    return c_vb * beta / (beta + 1.0), c_vb
+
+
+# Inlined into cavity_step by Numba; as a regular call it slows the step loop by ~40%
+@njit(cache=True, fastmath=True, inline='always')
+def mech_update_loops(u, state_m, state_tmp, Am, Bm, Cm, Dm):
+    """
+    Advance the mechanical states by one step with input u (MV^2) and return their detuning.
+
+    The output uses the states before the step; state_m is updated in place,
+    using state_tmp (same shape) as scratch.
+    """
+    # explicit loops: at 2 states per mode the BLAS call overhead exceeds the work
+    n_states = state_m.shape[0]
+    dw_mech = Dm[0, 0] * u
+    for c in range(n_states):
+        dw_mech += Cm[0, c] * state_m[c]
+    for r in range(n_states):
+        acc = Bm[r, 0] * u
+        for c in range(n_states):
+            acc += Am[r, c] * state_m[c]
+        state_tmp[r] = acc
+    state_m[:] = state_tmp
+    return dw_mech
+
+
+def mech_update_dot(u, state_m, state_tmp, Am, Bm, Cm, Dm):
+    """Variant of mech_update_loops with np.dot products, for interpreted runs"""
+    dw_mech = np.dot(Cm[0], state_m) + Dm[0, 0] * u
+    np.dot(Am, state_m, state_tmp)
+    np.add(state_tmp, Bm[:, 0] * u, out=state_m)
+    return dw_mech
+
+
+# Without Numba the explicit loops would run interpreted, so use np.dot for the products
+mech_update = mech_update_loops if NUMBA_AVAILABLE else mech_update_dot
+
+
+@njit(cache=True, fastmath=True)
+def cavity_step(half_bw, dw_step0, detuning0, vf_step, vb_step, state_vc, Ts,
+                c_vf, c_vb, state_m, state_tmp, Am, Bm, Cm, Dm):
+    """
+    Execute one cavity step, equivalent to llrflibs sim_scav_step with mech_exe=True.
+
+    c_vf and c_vb are the forward and beam voltage gains from drive_gains.
+    state_m is a 1-D ndarray holding the mechanical states and is updated in place,
+    using state_tmp (same shape) as scratch so that the step allocates nothing.
+    Returns the cavity voltage, reflected voltage and total detuning (rad/s).
+    """
+    # cavity equation, driven by the forward and beam voltages, expanded into
+    # real and imaginary parts so the compiled loop runs on plain float64 scalars
+    decay = 1.0 - Ts * half_bw
+    rot = Ts * dw_step0
+    vc_re = (decay * state_vc.real - rot * state_vc.imag
+             + c_vf * vf_step.real + c_vb * vb_step.real)
+    vc_im = (decay * state_vc.imag + rot * state_vc.real
+             + c_vf * vf_step.imag + c_vb * vb_step.imag)
+    vc = complex(vc_re, vc_im)
+    vr = vc - vf_step
+
+    # mechanical modes driven by the Lorentz force (input in MV^2)
+    u = (vc_re * vc_re + vc_im * vc_im) * 1e-12
+    dw_mech = mech_update(u, state_m, state_tmp, Am, Bm, Cm, Dm)
+
+    return vc, vr, dw_mech + detuning0
+
+
+@njit(cache=True, fastmath=True)
+def step_kernel(phasor, rot, amp, Ts, pulsed, base_pul, base_cw, buf_id,
+                gain_lin, wh, RL, c_vf, c_vb, dw, dw_micr, beam_pul, beam_cw,
+                state_vc, state_m, state_tmp, Ad, Bd, Cd, Dd):
+    """
+    Execute one step of the full RF chain: source, I/Q modulator, amplifier and cavity.
+
+    The RF source phase advances by multiplying the unit phasor with
+    rot = exp(1j*2*pi*fsrc*Ts) instead of evaluating exp() every step.
+    Returns (vc, vr, dw, phasor) with state_m updated in place.
+    """
+    # RF signal source
+    phasor = phasor * rot
+    S0 = amp * phasor
+
+    # I/Q modulator and beam, both indexed by the pulse buffer position
+    if pulsed:
+        idx = buf_id if buf_id < base_pul.shape[0] else base_pul.shape[0] - 1
+        S1 = S0 * base_pul[idx]
+        vb = -RL * beam_pul[idx]
+    else:
+        S1 = S0 * base_cw
+        vb = -RL * beam_cw
+
+    # Amplifier
+    S2 = S1 * gain_lin
+
+    # Cavity dynamics
+    vc, vr, dw = cavity_step(wh, dw, dw_micr, S2, vb, state_vc, Ts, c_vf, c_vb,
+                             state_m, state_tmp, Ad, Bd, Cd, Dd)
+    return vc, vr, dw, phasor
+
+
+@njit(cache=True, fastmath=True)
+def step_batch(n_steps, phasor, rot, amp, Ts, pulsed, pul_len, base_pul, base_cw,
+               buf_id, gain_lin, wh, RL, beta, dw, dw_micr, beam_pul, beam_cw, state_vc,
+               state_m, Ad, Bd, Cd, Dd, vc_out, vr_out, dw_out, mech_out):
+    """
+    Execute n_steps steps of the RF chain in a single call.
+
+    dw_micr holds the pre-drawn microphonics detuning (rad/s) of every step.
+    The cavity voltage, reflected voltage, detuning and the detuning of each
+    mechanical mode (one mech_out column per mode) are written to the
+    preallocated output arrays.
+    Returns the updated scalar states (phasor, buf_id, dw, state_vc).
+    """
+    # The modal model has two states per mode; the per-mode detuning is state_m[::2]
+    assert Ad.shape[0] == 2 * mech_out.shape[1], "expected two mechanical states per mode"
+    c_vf, c_vb = drive_gains(wh, Ts, beta)
+    state_tmp = np.empty_like(state_m)
+
+    for i in range(n_steps):
+        # emulate the pulse
+        if pulsed:
+            buf_id += 1
+            if buf_id >= pul_len:
+                buf_id = 0
+
+        vc, vr, dw, phasor = step_kernel(phasor, rot, amp, Ts, pulsed, base_pul,
+                                         base_cw, buf_id, gain_lin, wh, RL, c_vf,
+                                         c_vb, dw, dw_micr[i], beam_pul, beam_cw, state_vc,
+                                         state_m, state_tmp, Ad, Bd, Cd, Dd)
+        state_vc = vc
+
+        vc_out[i] = vc
+        vr_out[i] = vr
+        dw_out[i] = dw
+        mech_out[i, :] = state_m[::2]
+
+    # Keep the source phasor on the unit circle against rounding drift
+    phasor = phasor / abs(phasor)
+
+    return phasor, buf_id, dw, state_vc
+
+
+@njit(cache=True, fastmath=True)
+def run_cavity(vf, vb, dw_micr, wh, beta, Ts, state_vc, state_m, Ad, Bd, Cd, Dd):
+    """
+    Simulate the cavity for every sample of the precomputed forward voltage vf.
+
+    vb and dw_micr hold the beam voltage and the microphonics detuning (rad/s)
+    of every step. state_m is a 1-D ndarray holding the mechanical states and
+    is updated in place.
+    Returns the cavity voltage, reflected voltage, detuning (rad/s) and
+    per-mode mechanical detuning (rad/s) arrays.
+    """
+    num_steps = vf.shape[0]
+    c_vf, c_vb = drive_gains(wh, Ts, beta)
+    state_tmp = np.empty_like(state_m)
+    vc_out = np.empty(num_steps, dtype=np.complex128)
+    vr_out = np.empty(num_steps, dtype=np.complex128)
+    dw_out = np.empty(num_steps)
+    mech_out = np.empty((num_steps, state_m.shape[0] // 2))
+    dw = 0.0
+
+    for step in range(num_steps):
+        vc, vr, dw = cavity_step(wh, dw, dw_micr[step], vf[step], vb[step], state_vc, Ts,
+                                 c_vf, c_vb, state_m, state_tmp, Ad, Bd, Cd, Dd)
+        state_vc = vc
+
+        vc_out[step] = vc
+        vr_out[step] = vr
+        dw_out[step] = dw
+        mech_out[step, :] = state_m[::2]
+
+    return vc_out, vr_out, dw_out, mech_out
+
+
+# Without Numba, prefer the statically compiled Cython run_cavity when it was built
+if not NUMBA_AVAILABLE:
+    try:
+        from cavity_kernels_cy import run_cavity  # noqa: F811
+    except ImportError:
+        pass
+
+
+@njit(parallel=True, cache=True)
+def run_cavity_batch(vf, vb, dw_micr, wh, beta, Ts, Ad, Bd, Cd, Dd):
+    """
+    Simulate independent runs in parallel, one per row of vf, vb and dw_micr.
+
+    Every run starts from zero cavity and mechanical states. Returns the cavity
+    voltage, reflected voltage and detuning (rad/s) arrays of shape (n_runs, n_steps)
+    and the per-mode mechanical detuning (rad/s) of shape (n_runs, n_steps, n_modes).
+    """
+    n_runs, num_steps = vf.shape
+    n_states = Bd.shape[0]
+    vc_out = np.empty((n_runs, num_steps), dtype=np.complex128)
+    vr_out = np.empty((n_runs, num_steps), dtype=np.complex128)
+    dw_out = np.empty((n_runs, num_steps))
+    mech_out = np.empty((n_runs, num_steps, n_states // 2))
+
+    for k in prange(n_runs):
+        vc, vr, dw, mech = run_cavity(vf[k], vb[k], dw_micr[k], wh, beta, Ts, 0.0,
+                                      np.zeros(n_states), Ad, Bd, Cd, Dd)
+        vc_out[k] = vc
+        vr_out[k] = vr
+        dw_out[k] = dw
+        mech_out[k] = mech
+
+    return vc_out, vr_out, dw_out, mech_out
+
+
+@njit(parallel=True, cache=True)
+def scan_kernel(n_steps, amps, fsrcs, beam_puls, phasor, Ts, pulsed, pul_len,
+                base_pul, base_cw, buf_id, gain_lin, wh, RL, beta, dw, dw_micr,
+                beam_cw, state_vc, state_m, Ad, Bd, Cd, Dd):
+    """
+    Run n_steps steps for every sweep point, each from a copy of the given state.
+
+    amps, fsrcs and beam_puls (one beam profile per row) hold the per-point
+    parameters, while all points share the microphonics sequence dw_micr.
+    Returns an array of shape (n_points, 3) with the final cavity voltage
+    magnitude (MV), its phase (deg) and the reflected voltage magnitude (MV).
+    """
+    n_points = amps.shape[0]
+    n_modes = state_m.shape[0] // 2
+    results = np.empty((n_points, 3))
+
+    for k in prange(n_points):
+        vc_out = np.empty(n_steps, dtype=np.complex128)
+        vr_out = np.empty(n_steps, dtype=np.complex128)
+        dw_out = np.empty(n_steps)
+        mech_out = np.empty((n_steps, n_modes))
+        rot = np.exp(1j * 2.0 * np.pi * fsrcs[k] * Ts)
+        step_batch(n_steps, phasor, rot, amps[k], Ts, pulsed, pul_len, base_pul,
+                   base_cw, buf_id, gain_lin, wh, RL, beta, dw, dw_micr, beam_puls[k], beam_cw,
+                   state_vc, state_m.copy(), Ad, Bd, Cd, Dd, vc_out, vr_out, dw_out,
+                   mech_out)
+
+        results[k, 0] = abs(vc_out[-1]) * 1e-6
+        results[k, 1] = np.angle(vc_out[-1]) * 180 / np.pi
+        results[k, 2] = abs(vr_out[-1]) * 1e-6
+
+    return results
+
+
+def scan_lockstep(n_steps, amps, fsrcs, beam_puls, phasor, Ts, pulsed, pul_len,
+                  base_pul, base_cw, buf_id, gain_lin, wh, RL, beta, dw, dw_micr,
+                  beam_cw, state_vc, state_m, Ad, Bd, Cd, Dd):
+    """
+    Vectorized equivalent of scan_kernel stepping all sweep points together.
+
+    Each step advances the cavity and mechanical states of every point with
+    elementwise NumPy operations, so only n_steps iterations run in Python.
+    Takes the same arguments and returns the same (n_points, 3) array as scan_kernel.
+    """
+    n_points = amps.shape[0]
+    rot = np.exp(1j * 2.0 * np.pi * fsrcs * Ts)
+    phasor = np.full(n_points, phasor, dtype=np.complex128)
+    vc = np.full(n_points, state_vc, dtype=np.complex128)
+    vr = np.zeros(n_points, dtype=np.complex128)
+    dw = np.full(n_points, dw, dtype=np.float64)
+    state_m = np.tile(state_m, (n_points, 1))
+    AdT, Bd0, Cd0, Dd00 = Ad.T, Bd[:, 0], Cd[0], Dd[0, 0]
+    c_vf, c_vb = drive_gains(wh, Ts, beta)
+
+    for i in range(n_steps):
+        # emulate the pulse
+        if pulsed:
+            buf_id += 1
+            if buf_id >= pul_len:
+                buf_id = 0
+            idx = min(buf_id, base_pul.shape[0] - 1)
+            base, vb = base_pul[idx], -RL * beam_puls[:, idx]
+        else:
+            base, vb = base_cw, -RL * beam_cw
+
+        # RF source, I/Q modulator and amplifier
+        phasor *= rot
+        vf = amps * phasor * (base * gain_lin)
+
+        # Cavity dynamics and mechanical modes (see cavity_step)
+        vc = (1.0 - Ts * (wh - 1j * dw)) * vc + c_vf * vf + c_vb * vb
+        vr = vc - vf
+        u = (vc.real * vc.real + vc.imag * vc.imag) * 1e-12
+        dw = state_m @ Cd0 + Dd00 * u + dw_micr[i]
+        state_m = state_m @ AdT + u[:, None] * Bd0
+
+    return np.column_stack((np.abs(vc) * 1e-6, np.angle(vc) * 180 / np.pi, np.abs(vr) * 1e-6))
+
+
+def run_ensemble(vf, vb, n_runs, wh, beta, Ts, Ad, Bd, Cd, Dd, micr_std=2.0 * np.pi * 10,
+                 seed=None, use_gpu=CUPY_AVAILABLE):
+    """
+    Simulate n_runs independent microphonics realizations of the cavity together.
+
+    All runs share the forward voltage vf and beam voltage vb and start at rest.
+    They are advanced in lockstep as length-n_runs vectors, on the GPU with CuPy
+    when use_gpu is set. Returns NumPy arrays of the cavity voltage and detuning
+    (rad/s), both of shape (len(vf), n_runs).
+    """
+    xp = cupy if use_gpu else np
+    rng = xp.random.default_rng(seed)
+    vf = xp.asarray(vf)
+    AdT, Bd0, Cd0, Dd00 = xp.asarray(Ad.T), xp.asarray(Bd[:, 0]), xp.asarray(Cd[0]), float(Dd[0, 0])
+    num_steps = vf.shape[0]
+    c_vf, c_vb = drive_gains(wh, Ts, beta)
+
+    vc_out = xp.empty((num_steps, n_runs), dtype=xp.complex128)
+    dw_out = xp.empty((num_steps, n_runs), dtype=xp.float64)
+    vc = xp.zeros(n_runs, dtype=xp.complex128)
+    dw = xp.zeros(n_runs, dtype=xp.float64)
+    state_m = xp.zeros((n_runs, Ad.shape[0]), dtype=xp.float64)
+
+    for step in range(num_steps):
+        # Cavity dynamics and mechanical modes of every run (see cavity_step)
+        vc = (1.0 - Ts * (wh - 1j * dw)) * vc + c_vf * vf[step] + c_vb * vb
+        u = (vc.real * vc.real + vc.imag * vc.imag) * 1e-12
+        dw = state_m @ Cd0 + Dd00 * u + micr_std * rng.standard_normal(n_runs)
+        state_m = state_m @ AdT + u[:, None] * Bd0
+
+        vc_out[step] = vc
+        dw_out[step] = dw
+
+    if use_gpu:
+        return cupy.asnumpy(vc_out), cupy.asnumpy(dw_out)
+    return vc_out, dw_out
@@ -0,0 +1,92 @@
+# cython: language_level=3, boundscheck=False, wraparound=False, cdivision=True
+"""
+Virtual Cavity Simulator - Cython Cavity Kernel
+
+Project: Virtual Cavity RF Simulator
+Author: Ming Liu (mliu@ihep.ac.cn)
+Institution: Institute of High Energy Physics, Chinese Academy of Sciences
+Created: 2026-10-15
+Version: Unreleased (after 1.0.0)
+
+Description:
+    Statically compiled version of cavity_kernels.run_cavity for installs
+    without Numba. The cavity update and the mechanical state-space
+    recursion run on typed C scalars and memoryviews, with no Python
+    objects created inside the step loop.
+
+Build:
+    pip install cython && python setup.py build_ext --inplace
+
+License:
+    MIT License - see LICENSE file for details
+"""
+import numpy as np
+from libc.math cimport isfinite
+
+
+def run_cavity(const double complex[::1] vf, const double complex[::1] vb, const double[::1] dw_micr,
+               double wh, double beta, double Ts, double complex state_vc,
+               double[::1] state_m, const double[:, ::1] Ad, const double[:, ::1] Bd,
+               const double[:, ::1] Cd, const double[:, ::1] Dd):
+    """
+    Simulate the cavity for every sample of the precomputed forward voltage vf.
+
+    Same arguments and results as cavity_kernels.run_cavity; state_m is updated in place.
+    """
+    cdef Py_ssize_t num_steps = vf.shape[0]
+    cdef Py_ssize_t n_states = state_m.shape[0]
+    cdef Py_ssize_t n_modes = n_states // 2
+    cdef Py_ssize_t step, r, c
+
+    vc_arr = np.empty(num_steps, dtype=np.complex128)
+    vr_arr = np.empty(num_steps, dtype=np.complex128)
+    dw_arr = np.empty(num_steps, dtype=np.float64)
+    mech_arr = np.empty((num_steps, n_modes), dtype=np.float64)
+    cdef double complex[::1] vc_out = vc_arr
+    cdef double complex[::1] vr_out = vr_arr
+    cdef double[::1] dw_out = dw_arr
+    cdef double[:, ::1] mech_out = mech_arr
+    cdef double[::1] next_m = np.empty(n_states, dtype=np.float64)
+
+    cdef double vc_re = state_vc.real
+    cdef double vc_im = state_vc.imag
+    cdef double decay = 1.0 - Ts * wh
+    cdef double dw = 0.0
+    cdef double rot, re, im, u, acc
+
+    # forward and beam voltage gains, constant for the run
+    if not (isfinite(beta) and beta >= 0.0):
+        raise ValueError("beta must be a finite, non-negative coupling factor")
+    cdef double c_vb = 2.0 * wh * Ts
+    cdef double c_vf = c_vb * beta / (beta + 1.0)
+
+    for step in range(num_steps):
+        # cavity equation, driven by the forward and beam voltages, on the
+        # real and imaginary parts carried as separate doubles
+        rot = Ts * dw
+        re = decay * vc_re - rot * vc_im + c_vf * vf[step].real + c_vb * vb[step].real
+        im = decay * vc_im + rot * vc_re + c_vf * vf[step].imag + c_vb * vb[step].imag
+        vc_re = re
+        vc_im = im
+        vc_out[step] = vc_re + 1j * vc_im
+        vr_out[step] = (vc_re - vf[step].real) + 1j * (vc_im - vf[step].imag)
+
+        # mechanical modes driven by the Lorentz force (input in MV^2)
+        u = (vc_re * vc_re + vc_im * vc_im) * 1e-12
+        acc = Dd[0, 0] * u
+        for c in range(n_states):
+            acc += Cd[0, c] * state_m[c]
+        dw = acc + dw_micr[step]
+
+        for r in range(n_states):
+            acc = Bd[r, 0] * u
+            for c in range(n_states):
+                acc += Ad[r, c] * state_m[c]
+            next_m[r] = acc
+        state_m[:] = next_m
+        for r in range(n_modes):
+            mech_out[step, r] = next_m[2 * r]
+
+        dw_out[step] = dw
+
+    return vc_arr, vr_arr, dw_arr, mech_arr
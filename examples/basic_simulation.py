@@ -19,14 +19,18 @@ License:
     MIT License - see LICENSE file for details
 """
 
+import os
+import sys
 import numpy as np
 import matplotlib.pyplot as plt
-from llrflibs.rf_sim import cav_ss_mech, sim_scav_step
-from llrflibs.rf_control import ss_discrete
 
-def basic_cavity_simulation():
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+from cavity_kernels import CUPY_AVAILABLE, mech_state_space, run_cavity, run_ensemble
+
+def basic_cavity_simulation(seed=None, num_runs=0):
     """
-    Demonstrate basic cavity simulation
+    Demonstrate basic cavity simulation; pass a seed for reproducible microphonics
+    and num_runs to also simulate an ensemble of microphonics realizations
     """
     print("Virtual Cavity RF Simulator - Basic Example")
     print("=" * 50)
@@ -34,6 +38,7 @@ def basic_cavity_simulation():
     # Simulation parameters
     Ts = 1e-6  # Time step (1 μs)
     num_steps = 5000  # Number of simulation steps
+    rng = np.random.default_rng(seed)  # Microphonics random generator
     
     # Cavity parameters
     f0 = 1.3e9  # Resonant frequency (1.3 GHz)
@@ -52,76 +57,40 @@ def basic_cavity_simulation():
     
     # Initialize state space model
     print("Initializing mechanical state space model...")
-    status, Am, Bm, Cm, Dm = cav_ss_mech(mech_modes)
-    status, Ad, Bd, Cd, Dd, _ = ss_discrete(
-        Am, Bm, Cm, Dm, Ts=Ts, method='zoh', plot=False, plot_pno=10000)
+    Ad, Bd, Cd, Dd = mech_state_space(mech_modes, Ts)
     
     # Initial conditions
     state_vc = 0.0  # Cavity voltage state
-    state_m = np.matrix(np.zeros(Bd.shape))  # Mechanical states
-    dw = 0  # Detuning
+    state_m = np.zeros(Bd.shape[0])  # Mechanical states
     
     # RF parameters
     amplitude = 1.0  # RF amplitude
     frequency_offset = -460  # Frequency offset (Hz)
     beam_current = 0.008  # Beam current (A)
     
-    # Storage arrays
-    time_array = np.zeros(num_steps)
-    cavity_voltage = np.zeros(num_steps, dtype=complex)
-    reflected_voltage = np.zeros(num_steps, dtype=complex)
-    detuning_array = np.zeros(num_steps)
+    # Drive signals for all steps
+    time_array = np.arange(num_steps) * Ts
+    omega_offset = 2 * np.pi * frequency_offset
+    rf_signal = amplitude * np.exp(1j * omega_offset * time_array)  # RF source signal
+    vb = -RL * beam_current  # Beam voltage
+    dw_micr = 2.0 * np.pi * 10 * rng.standard_normal(num_steps)  # Microphonics
     
     print(f"Running simulation for {num_steps} steps...")
     
-    # Simulation loop
-    for step in range(num_steps):
-        current_time = step * Ts
-        time_array[step] = current_time
-        
-        # RF source signal
-        rf_signal = amplitude * np.exp(1j * 2 * np.pi * frequency_offset * current_time)
-        
-        # Beam voltage
-        vb = -RL * beam_current
-        
-        # Microphonics (random vibrations)
-        dw_micr = 2.0 * np.pi * np.random.randn() * 10
-        
-        # Cavity simulation step
-        status, vc, vr, dw, state_m = sim_scav_step(
-            wh,                    # Half bandwidth
-            dw,                    # Current detuning
-            0 + dw_micr,          # Detuning step with microphonics
-            rf_signal,            # Forward voltage
-            vb,                   # Beam voltage
-            state_vc,             # Current cavity state
-            Ts,                   # Time step
-            beta=beta,            # Coupling coefficient
-            state_m0=state_m,     # Mechanical states
-            Am=Ad, Bm=Bd, Cm=Cd, Dm=Dd,  # State space matrices
-            mech_exe=True         # Enable mechanical coupling
-        )
-        
-        # Update states
-        state_vc = vc
-        
-        # Store results
-        cavity_voltage[step] = vc
-        reflected_voltage[step] = vr
-        detuning_array[step] = dw / (2 * np.pi)  # Convert to Hz
-        
-        # Progress indicator
-        if step % 1000 == 0:
-            progress = (step / num_steps) * 100
-            print(f"Progress: {progress:.1f}%")
+    # Simulation loop, compiled as a whole (same update as llrflibs sim_scav_step)
+    cavity_voltage, reflected_voltage, dw_array, _ = run_cavity(
+        rf_signal, np.full(num_steps, vb, dtype=complex), dw_micr, wh, beta, Ts,
+        state_vc, state_m, Ad, Bd, Cd, Dd)
+    detuning_array = np.divide(dw_array, 2 * np.pi, out=dw_array)  # Convert to Hz in place
     
     print("Simulation completed!")
     
-    # Calculate results
-    vc_magnitude = np.abs(cavity_voltage) * 1e-6  # Convert to MV
-    vc_phase = np.angle(cavity_voltage) * 180 / np.pi  # Convert to degrees
-    vr_magnitude = np.abs(reflected_voltage) * 1e-6  # Convert to MV
+    # Calculate results, scaling in place to avoid temporary arrays
+    vc_magnitude = np.abs(cavity_voltage)
+    vc_magnitude *= 1e-6  # Convert to MV
+    vc_phase = np.angle(cavity_voltage, deg=True)  # Degrees
+    vr_magnitude = np.abs(reflected_voltage)
+    vr_magnitude *= 1e-6  # Convert to MV
     
     # Print summary statistics
     print(f"\nSimulation Results:")
@@ -130,6 +99,14 @@ def basic_cavity_simulation():
     print(f"Average reflected voltage: {np.mean(vr_magnitude):.2f} MV")
     print(f"Final detuning: {detuning_array[-1]:.1f} Hz")
     
+    # Optional ensemble of independent microphonics realizations (GPU with CuPy)
+    if num_runs:
+        print(f"\nRunning ensemble of {num_runs} runs on the {'GPU' if CUPY_AVAILABLE else 'CPU'}...")
+        vc_runs, _ = run_ensemble(rf_signal, vb, num_runs, wh, beta, Ts, Ad, Bd, Cd, Dd, seed=seed)
+        final_magnitude = np.abs(vc_runs[-1]) * 1e-6  # Convert to MV
+        print(f"Ensemble final cavity voltage: {np.mean(final_magnitude):.2f} ± "
+              f"{np.std(final_magnitude):.2f} MV")
+    
     # Create plots
     create_plots(time_array, vc_magnitude, vc_phase, vr_magnitude, detuning_array)
     
@@ -20,6 +20,7 @@ Features:
 
 Dependencies:
     - numpy: Numerical computing
+    - scipy: Mechanical model discretization
     - matplotlib: Plotting and visualization
     - tkinter: GUI framework (usually included with Python)
     - llrflibs: RF cavity simulation library
@@ -35,11 +36,13 @@ Changelog:
 """
 import sys
 import os
+import importlib.util
 
 def check_dependencies():
     """Check and install required dependencies"""
     required_packages = [
         'numpy',
+        'scipy',
         'matplotlib', 
         'tkinter'  # Usually comes with Python
     ]
@@ -47,13 +50,11 @@ def check_dependencies():
     missing_packages = []
     
     for package in required_packages:
-        try:
-            if package == 'tkinter':
-                import tkinter
-            else:
-                __import__(package)
+        # Locate the package without importing it (tkinter needs its C extension)
+        module = '_tkinter' if package == 'tkinter' else package
+        if importlib.util.find_spec(module) is not None:
             print(f"✓ {package} is available")
-        except ImportError:
+        else:
             missing_packages.append(package)
             print(f"✗ {package} is missing")
     
@@ -67,8 +68,8 @@ def check_dependencies():
 def check_llrflibs():
     """Check LLRFLibsPy availability"""
     try:
-        from llrflibs.rf_sim import cav_ss_mech, sim_scav_step
-        from llrflibs.rf_control import ss_discrete
+        if importlib.util.find_spec('llrflibs.rf_sim') is None:
+            raise ImportError("No module named 'llrflibs.rf_sim'")
         print("✓ LLRFLibsPy is available")
         return True
     except ImportError as e:
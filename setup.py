@@ -9,7 +9,7 @@ Created: 2025-09-01
 Version: 1.0.0
 """
 
-from setuptools import setup, find_packages
+from setuptools import setup, find_packages, Extension
 import os
 
 # Read long description from README
@@ -32,6 +32,15 @@ def read_requirements():
     except FileNotFoundError:
         return ['numpy>=1.19.0', 'matplotlib>=3.3.0']
 
+# Optional Cython build of the cavity kernel (used when Numba is not installed)
+def cython_extensions():
+    """Return the compiled kernel extensions, or none when Cython is unavailable"""
+    try:
+        from Cython.Build import cythonize
+    except ImportError:
+        return []
+    return cythonize([Extension('cavity_kernels_cy', ['cavity_kernels_cy.pyx'])])
+
 # Package metadata
 setup(
     name="virtual-cavity-simulator",
@@ -50,6 +59,7 @@ setup(
     
     # Package configuration
     packages=find_packages(),
+    ext_modules=cython_extensions(),
     include_package_data=True,
     
     # Dependencies
@@ -138,6 +148,12 @@ setup(
             'jupyter>=1.0.0',
             'ipywidgets>=7.6.0',
         ],
+        'fast': [
+            'numba>=0.53.0',
+        ],
+        'cython': [
+            'cython>=0.29.0',
+        ],
     },
     
     # ZIP safe
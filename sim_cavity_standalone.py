@@ -31,9 +31,11 @@ Dependencies:
     - numpy: Numerical computing
     - matplotlib: Plotting and visualization
     - llrflibs: RF cavity simulation library
+    - scipy: Matrix exponential for the mechanical model discretization
+    - numba: JIT compilation of the cavity recursion (optional, via cavity_kernels)
 
 Usage:
-    python sim_cavity_standalone.py
+    python sim_cavity_standalone.py [--sim-len N] [--seed S] [--no-plot | --save FILE]
 
 License:
     MIT License - see LICENSE file for details
@@ -41,10 +43,11 @@ License:
 Changelog:
     v1.0.0 (2025-09-01): Initial release with validated simulation accuracy
 """
+import argparse
+
 import numpy as np
 import matplotlib.pyplot as plt
-from llrflibs.rf_sim import cav_ss_mech, sim_scav_step
-from llrflibs.rf_control import ss_discrete
+from cavity_kernels import mech_state_space, run_cavity, run_cavity_batch
 
 # Simulation parameters
 Ts = 1e-6  # Simulation time step, seconds
@@ -64,18 +67,6 @@ t_flat = 1300
 sim_len = 2048 * 4  # Reduce simulation length for quick testing
 pul_len = 2048 * 2
 
-# LLRFLibsPy state space initialization
-print("Initializing mechanical mode state space...")
-status, Am, Bm, Cm, Dm = cav_ss_mech(mech_modes)
-status, Ad, Bd, Cd, Dd, _ = ss_discrete(Am, Bm, Cm, Dm, Ts=Ts, method='zoh', plot=False, plot_pno=10000)
-print(f"State space initialization complete, number of mechanical modes: {len(mech_modes['f'])}")
-
-# Simulation states
-state_m = np.matrix(np.zeros(Bd.shape))
-state_vc = 0.0
-pha_src = 0.0
-buf_id = 0
-
 # Control parameters
 amp = 1.0  # RF source amplitude (Asrc)
 phase = 0.0  # RF source phase (degrees)
@@ -93,159 +84,174 @@ base_pul = np.zeros(buf_size, dtype=complex)
 base_cw = 1
 base_pul[:t_flat] = 1.0
 
-# Helper functions (matching original exactly)
-def sim_rfsrc(fsrc, Asrc, pha_src, Ts):
-    pha = pha_src + 2.0 * np.pi * fsrc * Ts
-    return Asrc*np.exp(1j*pha), pha
-
-def sim_iqmod(sig_in, pulsed=True, base_pul=None, base_cw=0, buf_id=0):
-    if pulsed:
-        sig_out = sig_in * base_pul[buf_id if buf_id < len(base_pul) else -1]
-    else:
-        sig_out = sig_in * base_cw
-    return sig_out
-
-def sim_amp(sig_in, gain_dB):
-    return sig_in * 10.0**(gain_dB / 20.0)
-
-def sim_cav(half_bw, RL, dw_step0, detuning0, vf_step, state_vc, Ts, beta=1e4,
-            state_m0=0, Am=None, Bm=None, Cm=None, Dm=None,
-            pulsed=True, beam_pul=None, beam_cw=0, buf_id=0):
-    # get the beam
+gain_dB = 20 * np.log10(12e6)  # Amplifier gain
+gain_lin = 10.0**(gain_dB / 20.0)  # Linear amplifier gain, computed once for the whole run
+micr_scale = 2.0 * np.pi * 10  # Microphonics standard deviation (rad/s)
+
+def sim_inputs(sim_len=sim_len, amp=amp, fsrc=fsrc, pulsed=pulsed, seed=None):
+    """
+    Precompute the drive of a run: RF drive, beam voltage and microphonics.
+    seed makes the microphonics reproducible.
+    """
+    pha_src = 0.0
+    dpha = 2.0 * np.pi * fsrc * Ts  # RF source phase advance per step
+    
+    # RF drive for the whole run: RF source, I/Q modulator and amplifier.
+    # None of it depends on the cavity, so it is computed up front as arrays
+    # and only the cavity recursion runs step by step.
+    steps = np.arange(1, sim_len + 1)
+    pha = pha_src + dpha * steps
+    
+    # Modulation and beam profile of every step, so the recursion only
+    # does indexed lookups instead of branching on the pulse mode
     if pulsed:
-        vb = -RL * beam_pul[buf_id if buf_id < len(beam_pul) else -1]
+        buf_ids = steps % pul_len
+        mod_arr = base_pul[buf_ids]
+        beam_arr = beam_pul[buf_ids]
     else:
-        vb = -RL * beam_cw
+        mod_arr = np.full(sim_len, base_cw, dtype=complex)
+        beam_arr = np.full(sim_len, beam_cw, dtype=complex)
     
-    # execute for one step
-    status, vc, vr, dw, state_m = sim_scav_step(half_bw,
-                                                dw_step0,
-                                                detuning0, 
-                                                vf_step, 
-                                                vb, 
-                                                state_vc, 
-                                                Ts, 
-                                                beta=beta,
-                                                state_m0=state_m0, 
-                                                Am=Am, 
-                                                Bm=Bm, 
-                                                Cm=Cm, 
-                                                Dm=Dm,
-                                                mech_exe=True)           
-    state_vc = vc
+    # exp(1j*pha) from real cos/sin written straight into the drive array, then scaled in place
+    S2_all = np.empty(sim_len, dtype=complex)
+    np.cos(pha, out=S2_all.real)
+    np.sin(pha, out=S2_all.imag)
+    S2_all *= mod_arr
+    S2_all *= amp * gain_lin
+    vb_all = -RL * beam_arr
     
-    # return 
-    return vc, vr, dw, state_vc, state_m
-
-# Data storage
-sig_vc = np.zeros(sim_len, dtype=complex)
-sig_vr = np.zeros(sim_len, dtype=complex)
-sig_dw = np.zeros(sim_len, dtype=complex)
-sig_mech = np.zeros((sim_len, len(mech_modes['f'])), dtype=complex)
-
-print(f"Starting simulation, total steps: {sim_len}")
-
-# Main simulation loop
-dw = 0  # Initialize detuning state
-gain_dB = 20 * np.log10(12e6)  # Amplifier gain
-
-for i in range(sim_len):
-    if i % 1000 == 0:
-        print(f"Simulation progress: {i}/{sim_len}")
+    # Microphonics, drawn for every step at once
+    rng = np.random.default_rng(seed)
+    dw_micr_all = rng.standard_normal(sim_len) * micr_scale
+    return S2_all, vb_all, dw_micr_all
+
+def run_sim(sim_len=sim_len, amp=amp, fsrc=fsrc, pulsed=pulsed, seed=None):
+    """
+    Run the cavity simulation for sim_len steps without plotting.
+    Returns the cavity voltage, reflected voltage, detuning (rad/s) and
+    per-mode mechanical detuning (rad/s) arrays.
+    """
+    # Modal mechanical state space (one block per mode), discretized with ZOH (cached on disk across runs)
+    Ad, Bd, Cd, Dd = mech_state_space(mech_modes, Ts)
+    assert Ad.shape[0] == 2 * len(mech_modes['f']), "expected two mechanical states per mode"
     
-    # RF signal source
-    S0, pha_src = sim_rfsrc(fsrc, amp, pha_src, Ts)
+    # Simulation states
+    state_m = np.zeros(Bd.shape[0], dtype=np.float64)  # contiguous 1-D state vector, not np.matrix
+    state_vc = 0.0
     
-    # emulate the pulse
-    if pulsed:
-        buf_id += 1
-        if buf_id >= pul_len:
-            buf_id = 0
+    S2_all, vb_all, dw_micr_all = sim_inputs(sim_len, amp, fsrc, pulsed, seed)
     
-    # I/Q modulator
-    S1 = sim_iqmod(S0, 
-                   pulsed=pulsed,
-                   base_pul=base_pul,
-                   base_cw=base_cw,
-                   buf_id=buf_id)
+    # Cavity dynamics, compiled as a whole (same update as llrflibs sim_scav_step)
+    return run_cavity(S2_all, vb_all, dw_micr_all, wh, beta, Ts,
+                      state_vc, state_m, Ad, Bd, Cd, Dd)
+
+def run_sim_batch(param_list, sim_len=sim_len):
+    """
+    Run one independent simulation per dict of run_sim keyword arguments
+    (amp, fsrc, pulsed, seed), in parallel across cores when Numba is installed.
+    Returns the same arrays as run_sim with a leading axis over param_list.
+    """
+    Ad, Bd, Cd, Dd = mech_state_space(mech_modes, Ts)
+    inputs = [sim_inputs(sim_len, **params) for params in param_list]
+    S2_all, vb_all, dw_micr_all = (np.stack(arrays) for arrays in zip(*inputs))
+    return run_cavity_batch(S2_all, vb_all, dw_micr_all, wh, beta, Ts, Ad, Bd, Cd, Dd)
+
+def plot_results(sig_vc, sig_vr, sig_dw, sig_mech, save_path=None):
+    """Plot the simulated signals, saving them to save_path instead of showing when given"""
+    # Magnitude and phase from the real/imaginary views, without extra complex passes,
+    # converted to display units in place so each trace allocates a single array
+    vc_re, vc_im = sig_vc.real, sig_vc.imag
+    vc_mag = np.hypot(vc_re, vc_im)
+    vc_mag *= 1e-6
+    vc_ang = np.arctan2(vc_im, vc_re)
+    vc_ang *= 180 / np.pi
+    vr_mag = np.hypot(sig_vr.real, sig_vr.imag)
+    vr_mag *= 1e-6
+    dw_hz = sig_dw / (2 * np.pi)
     
-    # Amplifier
-    S2 = sim_amp(S1, gain_dB)
+    plt.figure(figsize=(12, 8))
     
-    # Microphonics
-    dw_micr = 2.0 * np.pi * np.random.randn() * 10
+    plt.subplot(3, 2, 1)
+    plt.plot(vc_mag)
+    plt.title('Cavity Voltage Amplitude (MV)')
+    plt.xlabel('Time Step')
+    plt.ylabel('Amplitude (MV)')
+
+    plt.subplot(3, 2, 2)
+    plt.plot(vc_ang)
+    plt.title('Cavity Voltage Phase (deg)')
+    plt.xlabel('Time Step')
+    plt.ylabel('Phase (deg)')
+
+    plt.subplot(3, 2, 3)
+    plt.plot(vr_mag)
+    plt.title('Reflected Voltage Amplitude (MV)')
+    plt.xlabel('Time Step')
+    plt.ylabel('Amplitude (MV)')
+
+    plt.subplot(3, 2, 4)
+    plt.plot(dw_hz)
+    plt.title('Detuning (Hz)')
+    plt.xlabel('Time Step')
+    plt.ylabel('Frequency (Hz)')
+
+    plt.subplot(3, 2, 5)
+    for i in range(min(3, len(mech_modes['f']))):
+        plt.plot(sig_mech[:, i], label=f'Mode {i+1} ({mech_modes["f"][i]} Hz)')
+    plt.title('Mechanical Mode Response')
+    plt.xlabel('Time Step')
+    plt.ylabel('Detuning (rad/s)')
+    plt.legend()
+
+    plt.subplot(3, 2, 6)
+    plt.plot(vc_re, label='Real')
+    plt.plot(vc_im, label='Imag')
+    plt.title('Cavity Voltage Complex')
+    plt.xlabel('Time Step')
+    plt.ylabel('Amplitude')
+    plt.legend()
+
+    plt.tight_layout()
+    if save_path:
+        plt.savefig(save_path, dpi=100)
+        plt.close()
+    else:
+        plt.show()
+
+def positive_int(text):
+    """argparse type for step counts: an integer of at least 1"""
+    try:
+        value = int(text)
+    except ValueError:
+        raise argparse.ArgumentTypeError(f"expected an integer, got {text!r}") from None
+    if value < 1:
+        raise argparse.ArgumentTypeError(f"must be at least 1, got {value}")
+    return value
+
+def main():
+    parser = argparse.ArgumentParser(description='Standalone RF cavity simulation')
+    parser.add_argument('--sim-len', type=positive_int, default=sim_len,
+                        help='number of simulation steps')
+    parser.add_argument('--no-plot', action='store_true',
+                        help='skip plotting, e.g. for benchmarking')
+    parser.add_argument('--seed', type=int, default=None,
+                        help='microphonics random seed')
+    parser.add_argument('--save', metavar='FILE', default=None,
+                        help='save the plots to FILE without opening a window')
+    args = parser.parse_args()
     
-    # Cavity dynamics
-    vc, vr, dw, state_vc, state_m = sim_cav(wh, RL, dw, 0 + dw_micr, S2, state_vc, Ts, 
-                                            beta=beta,
-                                            state_m0=state_m, 
-                                            Am=Ad, 
-                                            Bm=Bd, 
-                                            Cm=Cd,
-                                            Dm=Dd,
-                                            pulsed=pulsed, 
-                                            beam_pul=beam_pul, 
-                                            beam_cw=beam_cw, 
-                                            buf_id=buf_id)
+    print(f"Starting simulation, total steps: {args.sim_len}")
+    sig_vc, sig_vr, sig_dw, sig_mech = run_sim(args.sim_len, seed=args.seed)
+    print("Simulation complete")
     
-    # Store data
-    sig_vc[i] = vc
-    sig_vr[i] = vr
-    sig_dw[i] = dw
-    for j in range(len(mech_modes['f'])):
-        try:
-            sig_mech[i, j] = state_m[0, j]
-        except:
-            pass
-
-print("Simulation complete, starting plotting...")
-
-# Plotting
-plt.figure(figsize=(12, 8))
-
-plt.subplot(3, 2, 1)
-plt.plot(abs(sig_vc) * 1e-6)
-plt.title('Cavity Voltage Amplitude (MV)')
-plt.xlabel('Time Step')
-plt.ylabel('Amplitude (MV)')
-
-plt.subplot(3, 2, 2)
-plt.plot(np.angle(sig_vc) * 180 / np.pi)
-plt.title('Cavity Voltage Phase (deg)')
-plt.xlabel('Time Step')
-plt.ylabel('Phase (deg)')
-
-plt.subplot(3, 2, 3)
-plt.plot(abs(sig_vr) * 1e-6)
-plt.title('Reflected Voltage Amplitude (MV)')
-plt.xlabel('Time Step')
-plt.ylabel('Amplitude (MV)')
-
-plt.subplot(3, 2, 4)
-plt.plot(sig_dw / (2 * np.pi))
-plt.title('Detuning (Hz)')
-plt.xlabel('Time Step')
-plt.ylabel('Frequency (Hz)')
-
-plt.subplot(3, 2, 5)
-for i in range(min(3, len(mech_modes['f']))):
-    plt.plot(np.real(sig_mech[:, i]), label=f'Mode {i+1} ({mech_modes["f"][i]} Hz)')
-plt.title('Mechanical Mode Response')
-plt.xlabel('Time Step')
-plt.ylabel('Amplitude')
-plt.legend()
-
-plt.subplot(3, 2, 6)
-plt.plot(np.real(sig_vc), label='Real')
-plt.plot(np.imag(sig_vc), label='Imag')
-plt.title('Cavity Voltage Complex')
-plt.xlabel('Time Step')
-plt.ylabel('Amplitude')
-plt.legend()
-
-plt.tight_layout()
-plt.show()
-
-print("Cavity simulation test complete!")
-print(f"Final cavity voltage: {abs(sig_vc[-1])*1e-6:.3f} MV")
-print(f"Final detuning: {sig_dw[-1]/(2*np.pi):.1f} Hz")
+    if not args.no_plot:
+        if args.save:
+            plt.switch_backend('Agg')  # no GUI startup for headless or CI runs
+        plot_results(sig_vc, sig_vr, sig_dw, sig_mech, save_path=args.save)
+    
+    print("Cavity simulation test complete!")
+    print(f"Final cavity voltage: {abs(sig_vc[-1])*1e-6:.3f} MV")
+    print(f"Final detuning: {sig_dw[-1]/(2*np.pi):.1f} Hz")
+
+if __name__ == "__main__":
+    main()
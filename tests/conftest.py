@@ -85,6 +85,15 @@ def sample_data():
         'detuning': detuning
     }
 
+@pytest.fixture(autouse=True)
+def mech_cache_dir(tmp_path, monkeypatch):
+    """
+    Keep discretized mechanical models out of the user's cache directory
+    """
+    import cavity_kernels
+    monkeypatch.setattr(cavity_kernels, 'MECH_CACHE_DIR', str(tmp_path))
+    return tmp_path
+
 @pytest.fixture(scope="session")
 def test_output_dir(tmp_path_factory):
     """
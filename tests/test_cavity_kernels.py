@@ -0,0 +1,273 @@
+#!/usr/bin/env python3
+"""
+Tests for the cavity simulation kernels
+
+Project: Virtual Cavity RF Simulator
+Author: Ming Liu (mliu@ihep.ac.cn)
+Institution: Institute of High Energy Physics, Chinese Academy of Sciences
+Created: 2026-10-15
+Version: Unreleased (after 1.0.0)
+
+Description:
+    Checks the compiled kernels in cavity_kernels against a plain NumPy
+    implementation of the llrflibs sim_scav_step recurrence and against
+    each other (parallel vs serial, scan_kernel vs scan_lockstep), and the
+    modal mechanical model against the per-mode transfer functions.
+
+License:
+    MIT License - see LICENSE file for details
+"""
+
+import numpy as np
+import pytest
+from scipy import signal
+
+import cavity_kernels
+from cavity_kernels import (drive_gains, mech_state_space, run_cavity, run_cavity_batch,
+                            run_ensemble, scan_kernel, scan_lockstep)
+
+
+@pytest.fixture
+def mech_matrices(mechanical_modes, cavity_parameters):
+    """Discrete (Ad, Bd, Cd, Dd) of the mechanical modes, as used by the applications"""
+    return mech_state_space(mechanical_modes, cavity_parameters['Ts'])
+
+
+@pytest.fixture
+def drive(cavity_parameters):
+    """Forward voltage, beam voltage and microphonics of a short pulsed run"""
+    rng = np.random.default_rng(0)
+    num_steps = 300
+    vf = np.full(num_steps, 12e6 * np.exp(1j * 0.3))
+    vf[200:] = 0.0
+    vb = np.zeros(num_steps, dtype=complex)
+    vb[100:200] = -0.5 * cavity_parameters['roQ'] * cavity_parameters['QL'] * cavity_parameters['ib']
+    dw_micr = rng.standard_normal(num_steps) * 2.0 * np.pi * 10
+    return vf, vb, dw_micr
+
+
+def cavity_constants(cavity_parameters):
+    """Return the half bandwidth (rad/s), coupling factor and time step"""
+    wh = np.pi * cavity_parameters['f0'] / cavity_parameters['QL']
+    return wh, cavity_parameters['beta'], cavity_parameters['Ts']
+
+
+def mode_transfer_functions(mechanical_modes):
+    """(num, den) of every mode, -K*w^2 / (s^2 + w/Q*s + w^2) as in llrflibs cav_ss_mech"""
+    tfs = []
+    for f, Q, K in zip(mechanical_modes['f'], mechanical_modes['Q'], mechanical_modes['K']):
+        w = 2.0 * np.pi * f
+        tfs.append((np.array([-K * w ** 2]), np.array([1.0, w / Q, w ** 2])))
+    return tfs
+
+
+def reference_run(vf, vb, dw_micr, wh, beta, Ts, Ad, Bd, Cd, Dd):
+    """The llrflibs sim_scav_step recurrence (mech_exe=True) written out in NumPy"""
+    state_vc = 0.0 + 0.0j
+    state_m = np.zeros((Ad.shape[0], 1))
+    dw = 0.0
+    vc_out = np.empty(len(vf), dtype=complex)
+    vr_out = np.empty(len(vf), dtype=complex)
+    dw_out = np.empty(len(vf))
+    mech_out = np.empty((len(vf), Ad.shape[0] // 2))
+    for step in range(len(vf)):
+        vc = ((1 - Ts * (wh - 1j * dw)) * state_vc
+              + 2 * wh * Ts * (beta * vf[step] / (beta + 1) + vb[step]))
+        vr = vc - vf[step]
+        u = (np.abs(vc) * 1e-6) ** 2
+        dw = (Cd @ state_m + Dd * u)[0, 0] + dw_micr[step]
+        state_m = Ad @ state_m + Bd * u
+        state_vc = vc
+
+        vc_out[step], vr_out[step], dw_out[step] = vc, vr, dw
+        mech_out[step] = state_m[::2, 0]
+    return vc_out, vr_out, dw_out, mech_out
+
+
+class TestRunCavity:
+    def test_drive_gains(self, cavity_parameters):
+        """Test the drive gains and the rejection of a negative beta."""
+        wh, beta, Ts = cavity_constants(cavity_parameters)
+        c_vf, c_vb = drive_gains(wh, Ts, beta)
+        assert c_vb == pytest.approx(2 * wh * Ts)
+        assert c_vf == pytest.approx(2 * wh * Ts * beta / (beta + 1))
+        with pytest.raises(ValueError):
+            drive_gains(wh, Ts, -1.0)
+
+    def test_run_cavity_matches_reference(self, cavity_parameters, mech_matrices, drive):
+        """Test run_cavity against the sim_scav_step recurrence."""
+        wh, beta, Ts = cavity_constants(cavity_parameters)
+        vf, vb, dw_micr = drive
+        state_m = np.zeros(mech_matrices[0].shape[0])
+
+        result = run_cavity(vf, vb, dw_micr, wh, beta, Ts, 0.0 + 0.0j, state_m, *mech_matrices)
+        expected = reference_run(vf, vb, dw_micr, wh, beta, Ts, *mech_matrices)
+
+        for actual, wanted in zip(result, expected):
+            np.testing.assert_allclose(actual, wanted, rtol=1e-9, atol=1e-9 * np.abs(wanted).max())
+        # state_m is left at the final mechanical state
+        np.testing.assert_allclose(state_m[::2], expected[3][-1], rtol=1e-9)
+
+    def test_run_cavity_batch_matches_serial(self, cavity_parameters, mech_matrices, drive):
+        """Test that every parallel run equals a serial run_cavity call."""
+        wh, beta, Ts = cavity_constants(cavity_parameters)
+        vf, vb, dw_micr = drive
+        scales = np.array([0.5, 1.0, 1.5])
+        vf_rows = scales[:, None] * vf
+        vb_rows = np.tile(vb, (len(scales), 1))
+        micr_rows = np.stack([np.roll(dw_micr, k) for k in range(len(scales))])
+
+        batch = run_cavity_batch(vf_rows, vb_rows, micr_rows, wh, beta, Ts, *mech_matrices)
+
+        for k in range(len(scales)):
+            serial = run_cavity(vf_rows[k], vb_rows[k], micr_rows[k], wh, beta, Ts, 0.0 + 0.0j,
+                                np.zeros(mech_matrices[0].shape[0]), *mech_matrices)
+            for actual, wanted in zip(batch, serial):
+                np.testing.assert_allclose(actual[k], wanted, rtol=1e-12, atol=0)
+
+
+    def test_run_ensemble_matches_run_cavity(self, cavity_parameters, mech_matrices, drive):
+        """Test that every ensemble run without microphonics equals run_cavity."""
+        wh, beta, Ts = cavity_constants(cavity_parameters)
+        vf, vb, _ = drive
+        vb_const = vb[150]
+
+        vc, dw = run_ensemble(vf, vb_const, 3, wh, beta, Ts, *mech_matrices, micr_std=0.0,
+                              use_gpu=False)
+        serial = run_cavity(vf, np.full(len(vf), vb_const), np.zeros(len(vf)), wh, beta, Ts,
+                            0.0 + 0.0j, np.zeros(mech_matrices[0].shape[0]), *mech_matrices)
+
+        assert vc.shape == dw.shape == (len(vf), 3)
+        for k in range(3):
+            np.testing.assert_allclose(vc[:, k], serial[0], rtol=1e-11, atol=0)
+            np.testing.assert_allclose(dw[:, k], serial[2], rtol=1e-11,
+                                       atol=1e-11 * np.abs(serial[2]).max())
+
+    def test_run_ensemble_seed(self, cavity_parameters, mech_matrices, drive):
+        """Test that a seed repeats the ensemble and that the runs differ."""
+        wh, beta, Ts = cavity_constants(cavity_parameters)
+        vf = drive[0]
+
+        first = run_ensemble(vf, 0.0, 4, wh, beta, Ts, *mech_matrices, seed=3, use_gpu=False)
+        second = run_ensemble(vf, 0.0, 4, wh, beta, Ts, *mech_matrices, seed=3, use_gpu=False)
+        np.testing.assert_array_equal(first[1], second[1])
+        assert not np.allclose(first[1][:, 0], first[1][:, 1])
+
+
+class TestParameterScan:
+    @pytest.mark.parametrize('pulsed', [True, False])
+    def test_scan_kernel_matches_lockstep(self, cavity_parameters, mech_matrices, pulsed):
+        """Test that the parallel and vectorized scans agree."""
+        wh, beta, Ts = cavity_constants(cavity_parameters)
+        RL = 0.5 * cavity_parameters['roQ'] * cavity_parameters['QL']
+        rng = np.random.default_rng(1)
+        num_points, num_steps, buf_size, pul_len = 4, 200, 64, 80
+
+        amps = np.linspace(0.5, 1.5, num_points)
+        fsrcs = np.linspace(-500.0, 500.0, num_points)
+        beam_puls = np.zeros((num_points, buf_size), dtype=complex)
+        beam_puls[:, 20:40] = np.linspace(0.0, 0.016, num_points)[:, None]
+        base_pul = np.zeros(buf_size, dtype=complex)
+        base_pul[:50] = 1.0
+        dw_micr = rng.standard_normal(num_steps) * 2.0 * np.pi * 10
+        state_m = rng.standard_normal(mech_matrices[0].shape[0]) * 1e-3
+        state_m0 = state_m.copy()
+
+        common = (1.0 + 0.0j, Ts, pulsed, pul_len, base_pul, 1.0, 70, 12e6, wh, RL, beta,
+                  5.0, dw_micr, 0.008, 1e6 + 0.0j, state_m, *mech_matrices)
+        results = scan_kernel(num_steps, amps, fsrcs, beam_puls, *common)
+        expected = scan_lockstep(num_steps, amps, fsrcs, beam_puls, *common)
+
+        assert results.shape == (num_points, 3)
+        np.testing.assert_allclose(results, expected, rtol=1e-9, atol=1e-9)
+        # Every point starts from a copy of the given mechanical state
+        np.testing.assert_array_equal(state_m, state_m0)
+
+
+class TestMechStateSpace:
+    def test_modal_layout(self, mechanical_modes, cavity_parameters, mech_matrices, drive):
+        """Test that state_m[::2] holds the detuning of each mode on its own."""
+        wh, beta, Ts = cavity_constants(cavity_parameters)
+        vf, vb, dw_micr = drive
+        Ad, Bd, Cd, Dd = mech_matrices
+        assert Ad.shape == (2 * len(mechanical_modes['f']),) * 2
+
+        vc, _, dw, mech = run_cavity(vf, vb, np.zeros_like(dw_micr), wh, beta, Ts, 0.0 + 0.0j,
+                                     np.zeros(Ad.shape[0]), *mech_matrices)
+        u = np.abs(vc * 1e-6) ** 2
+
+        # Each mode discretized on its own; the sum of the modes is the detuning
+        mode_dw = []
+        for tf in mode_transfer_functions(mechanical_modes):
+            mode_ss = signal.cont2discrete(signal.tf2ss(*tf), Ts, method='zoh')
+            mode_dw.append(signal.dlsim(mode_ss, u)[1][:, 0])
+        for i, wanted in enumerate(mode_dw):
+            # mech holds the states after each step, dlsim the outputs before it
+            np.testing.assert_allclose(mech[:-1, i], wanted[1:], rtol=0,
+                                       atol=1e-9 * np.abs(wanted).max())
+        np.testing.assert_allclose(dw, np.sum(mode_dw, axis=0), rtol=0,
+                                   atol=1e-9 * np.abs(dw).max())
+        assert min(np.abs(wanted).max() for wanted in mode_dw) > 1e-3
+
+    def test_transfer_function_matches_llrflibs(self, mechanical_modes):
+        """Test the per-mode transfer functions against the llrflibs model."""
+        rf_sim = pytest.importorskip('llrflibs.rf_sim')
+        status, A, B, C, D = rf_sim.cav_ss_mech(mechanical_modes)
+        num, den = signal.ss2tf(np.asarray(A), np.asarray(B), np.asarray(C), np.asarray(D))
+
+        mode_num, mode_den = np.array([0.0]), np.array([1.0])
+        for tf_num, tf_den in mode_transfer_functions(mechanical_modes):
+            mode_num = np.polyadd(np.polymul(mode_num, tf_den), np.polymul(tf_num, mode_den))
+            mode_den = np.polymul(mode_den, tf_den)
+        np.testing.assert_allclose(den, mode_den, rtol=1e-9)
+        np.testing.assert_allclose(num[0, -len(mode_num):], mode_num, rtol=1e-9)
+
+    def test_rejects_mismatched_modes(self, cavity_parameters):
+        """Test that f, Q and K must have the same, non-zero length."""
+        with pytest.raises(ValueError):
+            mech_state_space({'f': [280, 341], 'Q': [40], 'K': [2, 0.8]}, cavity_parameters['Ts'])
+        with pytest.raises(ValueError):
+            mech_state_space({'f': [], 'Q': [], 'K': []}, cavity_parameters['Ts'])
+
+    def test_mech_state_space_disk_cache(self, mech_cache_dir, mechanical_modes, cavity_parameters):
+        """Test that discretized models are written to and reloaded from disk."""
+        cavity_kernels.discretize_mech.cache_clear()
+        Ts = cavity_parameters['Ts']
+
+        Ad, Bd, Cd, Dd = mech_state_space(mechanical_modes, Ts)
+        cache_files = list(mech_cache_dir.glob('ssdisc_*.npz'))
+        assert len(cache_files) == 1
+
+        # A fresh process (no in-memory cache) reloads the same matrices from disk
+        cavity_kernels.discretize_mech.cache_clear()
+        cached = mech_state_space(mechanical_modes, Ts)
+        for actual, wanted in zip(cached, (Ad, Bd, Cd, Dd)):
+            np.testing.assert_array_equal(actual, wanted)
+
+    @pytest.mark.parametrize('contents', [b'', b'PK\x03\x04 truncated', b'not an npz file'])
+    def test_unreadable_cache_file_is_replaced(self, mech_cache_dir, mechanical_modes,
+                                               cavity_parameters, contents):
+        """Test that an empty, truncated or garbage cache file is recomputed and overwritten."""
+        Ts = cavity_parameters['Ts']
+        cavity_kernels.discretize_mech.cache_clear()
+        expected = mech_state_space(mechanical_modes, Ts)
+        cache_file, = mech_cache_dir.glob('ssdisc_*.npz')
+        cache_file.write_bytes(contents)
+
+        cavity_kernels.discretize_mech.cache_clear()
+        for actual, wanted in zip(mech_state_space(mechanical_modes, Ts), expected):
+            np.testing.assert_array_equal(actual, wanted)
+        with np.load(cache_file) as cached:
+            np.testing.assert_array_equal(cached['Ad'], expected[0])
+
+    def test_failed_cache_write_leaves_no_temporary_file(self, mech_cache_dir, mechanical_modes,
+                                                         cavity_parameters, monkeypatch):
+        """Test that a failed cache write is ignored and cleaned up."""
+        def fail_replace(src, dst):
+            raise OSError("read-only cache")
+
+        monkeypatch.setattr(cavity_kernels.os, 'replace', fail_replace)
+        cavity_kernels.discretize_mech.cache_clear()
+        Ad, Bd, Cd, Dd = mech_state_space(mechanical_modes, cavity_parameters['Ts'])
+        assert Ad.shape == (2 * len(mechanical_modes['f']),) * 2
+        assert list(mech_cache_dir.iterdir()) == []
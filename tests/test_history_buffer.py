@@ -0,0 +1,102 @@
+#!/usr/bin/env python3
+"""
+Tests for the circular history buffer of the GUI
+
+Project: Virtual Cavity RF Simulator
+Author: Ming Liu (mliu@ihep.ac.cn)
+Institution: Institute of High Energy Physics, Chinese Academy of Sciences
+Created: 2026-10-15
+Version: Unreleased (after 1.0.0)
+
+Description:
+    Checks the oldest-first ordering of HistoryBuffer once it wraps around
+    and the round trip through to_dict() and load().
+
+License:
+    MIT License - see LICENSE file for details
+"""
+
+import json
+
+import numpy as np
+import pytest
+
+pytest.importorskip('tkinter')
+from advanced_cavity_gui import HistoryBuffer  # noqa: E402
+
+
+def fill(history, n_samples, record_from=None):
+    """Write n_samples samples one at a time, recording control parameters from record_from on"""
+    for i in range(n_samples):
+        idx = history.write_idx
+        history.data['time'][idx] = i * 1e-6
+        history.data['detuning'][idx] = -i
+        history.data['vc'][idx] = i * np.exp(1j * 0.1 * i)
+        history.data['vr'][idx] = -0.5j * i
+        history.mech_modes[:, idx] = i * np.arange(1, history.n_modes + 1)
+        if record_from is not None and i >= record_from:
+            history.control_params['amp'][idx] = 1.0 + i
+            history.control_params['phase'][idx] = 10.0
+            history.control_params['fsrc'][idx] = -460.0
+            history.control_params['pulsed'][idx] = i % 2
+        history.advance()
+
+
+class TestHistoryBuffer:
+    def test_partial_buffer_is_not_wrapped(self):
+        """Test the ordering before the buffer is full."""
+        history = HistoryBuffer(8, 2)
+        fill(history, 5)
+        assert len(history) == 5
+        np.testing.assert_array_equal(history.get_ordered('detuning'), -np.arange(5))
+
+    def test_wrapped_buffer_is_ordered_oldest_first(self):
+        """Test the oldest-first ordering after wrapping around."""
+        history = HistoryBuffer(8, 2)
+        fill(history, 13)
+
+        assert len(history) == 8
+        assert history.write_idx == 13 % 8
+        np.testing.assert_array_equal(history.get_ordered('detuning'), -np.arange(5, 13))
+        np.testing.assert_allclose(history.get_ordered('time'), np.arange(5, 13) * 1e-6)
+        np.testing.assert_array_equal(history.ordered(history.mech_modes)[1], 2 * np.arange(5, 13))
+
+    def test_clear_discards_samples(self):
+        """Test that clear() empties the buffer."""
+        history = HistoryBuffer(8, 2)
+        fill(history, 13)
+        history.clear()
+        assert len(history) == 0
+        assert history.get_ordered('time').size == 0
+
+    def test_to_dict_load_round_trip(self):
+        """Test that load() restores what to_dict() exported."""
+        history = HistoryBuffer(8, 3)
+        fill(history, 13, record_from=9)
+        # The export must be strict JSON (no NaN for samples taken while not recording)
+        data = json.loads(json.dumps(history.to_dict(), allow_nan=False))
+
+        assert data['control_params']['amp'] == [10.0, 11.0, 12.0, 13.0]
+        assert data['control_params']['pulsed'] == [True, False, True, False]
+
+        restored = HistoryBuffer(8, 3)
+        restored.load(data, data['mech_modes'], data['control_params'])
+
+        assert len(restored) == len(history)
+        for key in HistoryBuffer.FIELDS + HistoryBuffer.COMPLEX_FIELDS:
+            np.testing.assert_allclose(restored.get_ordered(key), history.get_ordered(key))
+        np.testing.assert_allclose(restored.ordered(restored.mech_modes), history.ordered(history.mech_modes))
+        for key in HistoryBuffer.CONTROL_PARAMS:
+            np.testing.assert_array_equal(restored.ordered(restored.control_params[key]),
+                                          history.ordered(history.control_params[key]))
+
+    def test_load_keeps_newest_samples(self):
+        """Test that load() keeps the newest samples when they do not fit."""
+        history = HistoryBuffer(8, 2)
+        fill(history, 8)
+        data = history.to_dict()
+
+        smaller = HistoryBuffer(5, 2)
+        smaller.load(data, data['mech_modes'])
+        assert len(smaller) == 5
+        np.testing.assert_array_equal(smaller.get_ordered('detuning'), -np.arange(3, 8))